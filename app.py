@@ -1,15 +1,21 @@
+import logging
+import os
 import pandas as pd
 import numpy as np
 from dash import Dash, html, dcc, Input, Output
+from pandas import DataFrame
 from dash_bootstrap_components.themes import BOOTSTRAP
 
-from components import dropdown_component, scattermap_component, barplot_component, scatterplot_component, parcat_component, stackedbar_component, checklist_component, data_cleaning, timeline_component
+from components import dropdown_component, scattermap_component, barplot_component, scatterplot_component, parcat_component, stackedbar_component, checklist_component, data_cleaning, timeline_component, data_loader, metrics, schema, background, ingest
 
-app = Dash(external_stylesheets=[BOOTSTRAP])
+# Record per-callback timings and payload sizes and serve them at /metrics (set ENABLE_METRICS=1 in the environment)
+ENABLE_METRICS = os.environ.get("ENABLE_METRICS", "0") == "1"
+# Run the heavy callbacks as background callbacks in separate processes (set BACKGROUND_CALLBACKS=1; needs diskcache, see background.py)
+BACKGROUND_CALLBACKS = os.environ.get("BACKGROUND_CALLBACKS", "0") == "1"
+# Add the incidents in CSV/Parquet files dropped into this directory while the app runs (set INGEST_DIR; see ingest.py)
+INGEST_DIR = os.environ.get("INGEST_DIR")
 
-# Read in data
-df = pd.read_excel('sharks_clean.xlsx')
-df["Victim.age"] = df["Victim.age"].apply(lambda x : "" if np.isnan(x) else str(int(x)))
+logger = logging.getLogger(__name__)
 
 # Options for dropdowns
 plotable_columns = ["Incident.month", "Victim.injury", "State", "Site.category", "Provoked/unprovoked", # "Present.at.time.of.bite", "Injury.location", # These two attributes have a lot of unknown/other values, but might still give insights
@@ -17,7 +23,7 @@ plotable_columns = ["Incident.month", "Victim.injury", "State", "Site.category",
 gradient_columns = ["Incident.month", "Incident.year", "Shark.length.m", "Victim.age", "Time.of.incident"]
 
 # Create actual layout
-def create_layout(app: Dash) -> html.Div:
+def create_layout(app: Dash, df: DataFrame) -> html.Div:
     return html.Div(
         className = "app-div",
         children=[
@@ -99,6 +105,8 @@ def create_layout(app: Dash) -> html.Div:
                             timeline_component.render(app, data=df, id = "timeline",)
                         ]
                     ),
+                    # New incidents (updates the slider and timeline above, so it comes after them)
+                    *([ingest.render(app, id="dataset_version")] if INGEST_DIR else []),
                     
             ]),
             # Main map
@@ -113,15 +121,6 @@ def create_layout(app: Dash) -> html.Div:
         style={"display": "flex", "flexDirection": "row", "gap": "10px", "margin": "20px"}
     )
 
-app.title = "Map"
-app.layout = create_layout(app)
-
-@app.callback(
-    [Output("left-col", "style"),
-     Output("right-col", "style"),
-     Output("toggle-button", "children")],
-    Input("toggle-button", "n_clicks")
-)
 def toggle_columns(n_clicks):
     if n_clicks % 2 == 1:  # Collapse left column
         left_style = {"display": "none"}
@@ -153,5 +152,46 @@ def toggle_columns(n_clicks):
 
     return left_style, right_style, button_text
 
+def create_app(source: str = 'sharks_clean.xlsx', watch_ingest_dir: bool = True) -> Dash:
+    '''
+    Builds the app (WSGI app factory). Every call loads the data and registers all callbacks on a new Dash app;
+    the WSGI application itself is the underlying Flask server, create_app().server (see wsgi.py).
+    The components keep the base dataset in module-level state (see dataset.py), so create one app per process.
+    With watch_ingest_dir=False the INGEST_DIR watcher is not started here; a server that forks worker processes
+    starts it in every worker instead (see gunicorn.conf.py).
+    '''
+    app = Dash(external_stylesheets=[BOOTSTRAP])
+
+    # Read in data (from the columnar cache if the Excel file has not changed since the last start)
+    df = data_loader.load_incidents(source)
+    # Plotable and groupable text columns become categoricals with a canonical order (see schema.py)
+    df = schema.encode_categories(df, plotable_columns + data_cleaning.GROUPABLE_FEATURES)
+
+    # Must happen before the components register their callbacks
+    if BACKGROUND_CALLBACKS and not background.enable():
+        logger.warning("BACKGROUND_CALLBACKS is set, but diskcache is not installed; running all callbacks synchronously")
+
+    app.title = "Map"
+    app.layout = create_layout(app, df)
+    if INGEST_DIR and watch_ingest_dir:
+        ingest.start(INGEST_DIR)  # Adds the files already in the directory first
+
+    app.callback(
+        [Output("left-col", "style"),
+         Output("right-col", "style"),
+         Output("toggle-button", "children")],
+        Input("toggle-button", "n_clicks")
+    )(toggle_columns)
+
+    # Only wrap the callbacks once all of them are registered
+    if ENABLE_METRICS:
+        stats = {"session_state": data_cleaning.session_state.stats, "store_pipeline": data_cleaning.pipeline.stats}
+        if INGEST_DIR:
+            stats["ingest"] = ingest.stats
+        metrics.instrument(app, stats=stats)
+    return app
 
-app.run_server(debug=True)
\ No newline at end of file
+# Single-process development server; see wsgi.py for running several worker processes
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)  # E.g. the files added or skipped by ingest.py
+    create_app().run(debug=True)
\ No newline at end of file
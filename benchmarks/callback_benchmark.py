@@ -0,0 +1,206 @@
+import argparse
+import json
+import platform
+import time
+import tracemalloc
+from contextvars import copy_context
+from statistics import median
+
+import dash
+import numpy as np
+import pandas as pd
+from dash import Dash
+from dash._callback_context import context_value
+from dash._utils import AttributeDict
+from pandas import DataFrame
+from plotly.io.json import to_json_plotly
+
+from app import plotable_columns
+from components import data_cleaning, data_loader, dataset, parcat_component, scattermap_component, schema, stackedbar_component, timeline_component
+
+"""
+Measures the callbacks that run on every interaction (data store, scatter map, stacked bar, parcat and timeline)
+as the dataset grows. Synthetic datasets with the schema of sharks_clean.xlsx are generated at several multiples of
+its size, the components are registered on a Dash app without starting a server, and every callback is called
+directly with representative inputs (slider ranges, a lasso selection, bar and parcat clicks).
+For every callback and scenario the wall time, peak memory (traced Python/numpy allocations) and the size of the
+JSON sent to the browser are reported, and all results are saved as JSON so runs can be compared.
+Run from the repository root with:
+    python -m benchmarks.callback_benchmark [--scales 1 10 100 1000] [--repeats 3] [--output results.json] [--baseline old.json]
+"""
+
+DEFAULT_SCALES = [1, 10, 100, 1000]
+PRIMARY_FEATURE = "State"
+PARCAT_FEATURES = ["State", "Victim.injury", "Site.category"]
+
+def synthetic_incidents(data: DataFrame, scale: int, seed: int = 0) -> DataFrame:
+    '''
+    Returns a dataset with the same columns and value distributions as data, scale times as large.
+    Rows are sampled with replacement from data, the coordinates are jittered slightly so points do not overlap exactly,
+    and every row gets a new unique UID. A scale of 1 returns the real data.
+    '''
+    if scale == 1:
+        return data.copy()
+    rng = np.random.default_rng(seed)
+    synthetic = data.iloc[rng.integers(0, len(data), size=len(data) * scale)].reset_index(drop=True)
+    synthetic["Latitude"] = synthetic["Latitude"] + rng.normal(0, 0.05, size=len(synthetic))
+    synthetic["Longitude"] = synthetic["Longitude"] + rng.normal(0, 0.05, size=len(synthetic))
+    synthetic = synthetic.sort_values("Incident.year", kind="stable").reset_index(drop=True)
+    synthetic["UID"] = np.arange(len(synthetic))
+    return synthetic
+
+def _register_callbacks(data: DataFrame) -> dict:
+    # Same components and ids as in app.py; only the callbacks are needed, not the layout
+    timeline_component.CLIENTSIDE = False  # The client-side timeline never reaches the server; measure its server-side version
+    app = Dash(__name__)
+    data_cleaning.store(app, id="data_store", all_data=data)
+    stackedbar_component.render(app, id="stacked_bar", all_data=data)
+    parcat_component.render(app, id="parcat", data=data)
+    timeline_component.render(app, data=data, id="timeline")
+    scattermap_component.render(app, all_data=data, id="map")
+
+    def find(output: str):
+        for key, value in app.callback_map.items():
+            if key.startswith(output) or "." + output in key:
+                return value["callback"].__wrapped__  # The undecorated callback function
+        raise KeyError(output)
+    return {"store": find("data_store.data"), "map": find("map.figure"), "stacked_bar": find("stacked_bar.figure"),
+            "parcat": find("parcat.figure"), "timeline": find("timehist.figure")}
+
+def _call(callback, args: tuple, trigger: str | None = None, value=None):
+    # Callbacks read ctx.triggered_id, so run them in a context that looks like a real request
+    def run():
+        triggered = [{"prop_id": trigger or ".", "value": value}]
+        context_value.set(AttributeDict(triggered_inputs=triggered, inputs_list=[], states_list=[], outputs_list=[]))
+        return callback(*args)
+    return copy_context().run(run)
+
+def _reset_caches():
+    # Every call is measured cold, so results do not depend on what earlier scenarios left in the caches: the state filled
+    # by interactions (memoized store stages, stacked bar figures, decoded store values, count cubes and their feature codes,
+    # hover templates) is dropped. What is built once per version of the data when the app starts (grouping codes,
+    # spatial index, the map's custom data) is kept, as in the running app.
+    data_cleaning.session_state.clear()
+    data_cleaning._decoded_frames.clear()
+    dataset.current().count_cubes.clear()
+    scattermap_component._get_hover_template.cache_clear()
+
+def _measure(callback, args: tuple, repeats: int, trigger: str | None = None, value=None, setup=None) -> tuple[dict, object]:
+    # setup (if given) runs after the caches are reset and before the measured call, e.g. to measure a click after a selection
+    timings = []
+    for _ in range(repeats):
+        _reset_caches()
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        output = _call(callback, args, trigger, value)
+        timings.append(time.perf_counter() - start)
+
+    # Peak memory is measured in a separate call, because tracing allocations slows the callback down
+    _reset_caches()
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    _call(callback, args, trigger, value)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    payload = output if isinstance(output, tuple) else (output,)
+    result = {"median_ms": median(timings) * 1000, "min_ms": min(timings) * 1000,
+              "peak_memory_kb": peak_memory / 1024,
+              "payload_bytes": sum(len(to_json_plotly(part)) for part in payload)}
+    return result, output
+
+def _scenarios(data: DataFrame) -> list[dict]:
+    '''
+    Representative store inputs: the full year range, a year window, a lasso selection within that window,
+    a click on a bar of the stacked bar chart, a click on a band of the parcat plot, and a bar click right after the
+    lasso selection ("after", which runs first), where the data store only recomputes the highlight.
+    '''
+    first_year, last_year = int(data["Incident.year"].min()), int(data["Incident.year"].max())
+    window = [1900, 1980]
+    # Lasso around the central half of the incidents (as sent by the browser: only the geometry, see data_cleaning.py)
+    west, east = data["Longitude"].quantile([0.25, 0.75])
+    south, north = data["Latitude"].quantile([0.25, 0.75])
+    lasso = {"lassoPoints": {"map": [[west, south], [east, south], [east, (south + north) / 2], [(west + east) / 2, north], [west, north]]}}
+    bar_click = {"points": [{"curveNumber": 0, "pointNumber": 0, "x": data[PRIMARY_FEATURE].mode()[0]}]}
+    parcat_click = {"points": [{"pointNumber": int(point)} for point in range(0, len(data), 100)]}
+    return [
+        {"name": "full range", "inputs": (None, [first_year, last_year], None, None, None), "trigger": "slider.value"},
+        {"name": "year window", "inputs": (None, window, None, None, None), "trigger": "slider.value"},
+        {"name": "lasso", "inputs": (lasso, window, None, None, None), "trigger": "map_selection.data"},
+        {"name": "bar click", "inputs": (None, [first_year, last_year], bar_click, None, None), "trigger": "stacked_bar.clickData"},
+        {"name": "parcat click", "inputs": (None, [first_year, last_year], None, parcat_click, None), "trigger": "parcat.clickData"},
+        {"name": "lasso + click", "inputs": (lasso, window, bar_click, None, None), "trigger": "stacked_bar.clickData",
+         "after": ((lasso, window, None, None, None), "map_selection.data")},
+    ]
+
+def run_scale(data: DataFrame, repeats: int) -> list[dict]:
+    callbacks = _register_callbacks(data)
+    results = []
+    def record(callback: str, scenario: str, measurement: dict):
+        results.append({"rows": len(data), "callback": callback, "scenario": scenario, **measurement})
+
+    for scenario in _scenarios(data):
+        # No session (nothing is coalesced) and no parcat paths (parcat clicks are indices of the selected incidents)
+        store_args = scenario["inputs"] + (PRIMARY_FEATURE, [], None, None)
+        setup = None
+        if "after" in scenario:
+            inputs, trigger = scenario["after"]
+            setup = lambda: _call(callbacks["store"], inputs + (PRIMARY_FEATURE, [], None, None), trigger)
+        measurement, store = _measure(callbacks["store"], store_args, repeats, scenario["trigger"], setup=setup)
+        record("store", scenario["name"], measurement)
+        store = json.loads(json.dumps(store))  # The other callbacks receive the store as the browser sends it back
+
+        bar_click = scenario["inputs"][2]
+        record("map", scenario["name"], _measure(callbacks["map"], (store, PRIMARY_FEATURE, [], None, None), repeats, "data_store.data")[0])
+        record("stacked_bar", scenario["name"], _measure(callbacks["stacked_bar"], (store, PRIMARY_FEATURE, [], [], bar_click), repeats,
+                                                         "stacked_bar.clickData" if bar_click else "data_store.data", bar_click)[0])
+        record("parcat", scenario["name"], _measure(callbacks["parcat"], (store, PARCAT_FEATURES, PRIMARY_FEATURE, []), repeats, "data_store.data")[0])
+        if scenario["trigger"] == "slider.value":
+            record("timeline", scenario["name"], _measure(callbacks["timeline"], (scenario["inputs"][1],), repeats, "slider.value")[0])
+    return results
+
+def _compare(results: list[dict], baseline_path: str):
+    with open(baseline_path) as file:
+        baseline = {(result["scale"], result["callback"], result["scenario"]): result for result in json.load(file)["results"]}
+    print(f"\nCompared with {baseline_path} (ratio of medians, > 1 is slower):")
+    for result in results:
+        old = baseline.get((result["scale"], result["callback"], result["scenario"]))
+        if old is not None:
+            print(f"{result['scale']:>6}x {result['callback']:<12}{result['scenario']:<14}{result['median_ms'] / old['median_ms']:>8.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the app callbacks on synthetic datasets")
+    parser.add_argument("--source", default=data_loader.DEFAULT_SOURCE)
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="callback_benchmark.json")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    data = data_loader.load_incidents(args.source)
+    results = []
+    print(f"{'scale':>7} {'rows':>9} {'callback':<12}{'scenario':<14}{'median (ms)':>12}{'peak (MB)':>11}{'payload (KB)':>14}")
+    for scale in args.scales:
+        synthetic = schema.encode_categories(synthetic_incidents(data, scale, args.seed), plotable_columns + data_cleaning.GROUPABLE_FEATURES)  # As in create_app
+        scale_results = run_scale(synthetic, args.repeats)
+        for result in scale_results:
+            result["scale"] = scale
+            print(f"{scale:>6}x {result['rows']:>9} {result['callback']:<12}{result['scenario']:<14}{result['median_ms']:>12.1f}"
+                  f"{result['peak_memory_kb'] / 1024:>11.1f}{result['payload_bytes'] / 1024:>14.1f}")
+        results += scale_results
+
+    report = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "repeats": args.repeats, "seed": args.seed,
+              "store_mode": data_cleaning.STORE_MODE, "store_codec": data_cleaning.STORE_CODEC,
+              "versions": {"python": platform.python_version(), "dash": dash.__version__, "pandas": pd.__version__, "numpy": np.__version__},
+              "results": results}
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=1)
+    print(f"\nSaved results to {args.output}")
+    if args.baseline:
+        _compare(results, args.baseline)
+
+if __name__ == "__main__":
+    main()
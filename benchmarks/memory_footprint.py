@@ -0,0 +1,42 @@
+import argparse
+
+from app import plotable_columns
+from benchmarks.callback_benchmark import synthetic_incidents
+from components import data_cleaning, data_loader, schema
+
+"""
+Reports the memory used by the incident dataframe before and after the categorical encoding of schema.py,
+per converted column and in total, for the real dataset and (optionally) synthetic datasets of several times its size.
+Run from the repository root with:
+    python -m benchmarks.memory_footprint [--scales 1 100]
+"""
+
+def _kb(size: float) -> str:
+    return f"{size / 1024:>12.1f}"
+
+def report(data, scale: int):
+    encoded = schema.encode_categories(data, plotable_columns + data_cleaning.GROUPABLE_FEATURES)
+    before = schema.memory_footprint(data)
+    after = schema.memory_footprint(encoded)
+    converted = [column for column in encoded.columns if encoded[column].dtype != data[column].dtype]
+
+    print(f"\n{scale}x ({len(data)} rows)")
+    print(f"{'column':<28}{'before (KB)':>12}{'after (KB)':>12}{'ratio':>8}")
+    for column in converted:
+        print(f"{column:<28}{_kb(before[column])}{_kb(after[column])}{before[column] / after[column]:>7.1f}x")
+    print(f"{'converted columns':<28}{_kb(before[converted].sum())}{_kb(after[converted].sum())}{before[converted].sum() / after[converted].sum():>7.1f}x")
+    print(f"{'whole dataframe':<28}{_kb(before.sum())}{_kb(after.sum())}{before.sum() / after.sum():>7.1f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the memory footprint of the categorical encoding")
+    parser.add_argument("--source", default=data_loader.DEFAULT_SOURCE)
+    parser.add_argument("--scales", type=int, nargs="+", default=[1])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    data = data_loader.load_incidents(args.source)
+    for scale in args.scales:
+        report(synthetic_incidents(data, scale, args.seed), scale)
+
+if __name__ == "__main__":
+    main()
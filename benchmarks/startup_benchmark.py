@@ -0,0 +1,51 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from statistics import median
+
+from components import data_loader
+
+"""
+Compares app start-up data loading: parsing sharks_clean.xlsx directly versus building and reading the columnar cache.
+Run from the repository root with:
+    python -m benchmarks.startup_benchmark [--source sharks_clean.xlsx] [--repeats 5]
+"""
+
+def _time(function, repeats: int) -> list[float]:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark data loading at start-up")
+    parser.add_argument("--source", default=data_loader.DEFAULT_SOURCE)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    if data_loader.feather is None:
+        print("pyarrow is not installed; only the xlsx path can be measured.")
+
+    cache_dir = tempfile.mkdtemp(prefix="shark_cache_")
+    try:
+        results = {"xlsx (read_excel + clean)": _time(lambda: data_loader.read_source(args.source), args.repeats)}
+        if data_loader.feather is not None:
+            def cold_start():
+                shutil.rmtree(cache_dir, ignore_errors=True)
+                data_loader.load_incidents(args.source, cache_dir=cache_dir)
+            results["cache, cold (build)"] = _time(cold_start, args.repeats)
+            results["cache, warm (memory-mapped)"] = _time(lambda: data_loader.load_incidents(args.source, cache_dir=cache_dir), args.repeats)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    baseline = median(results["xlsx (read_excel + clean)"])
+    print(f"{'path':<30}{'median (ms)':>14}{'min (ms)':>12}{'speed-up':>10}")
+    for name, timings in results.items():
+        print(f"{name:<30}{median(timings)*1000:>14.1f}{min(timings)*1000:>12.1f}{baseline/median(timings):>9.1f}x")
+
+if __name__ == "__main__":
+    main()
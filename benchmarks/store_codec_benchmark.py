@@ -0,0 +1,82 @@
+import argparse
+import json
+import time
+from statistics import median
+
+from plotly.io.json import to_json_plotly
+
+from app import plotable_columns
+from benchmarks.callback_benchmark import PRIMARY_FEATURE, _call, _register_callbacks, _scenarios, synthetic_incidents
+from components import data_cleaning, data_loader, schema, store_codec
+
+"""
+Compares the codecs of store_codec.py, which encode the filtered dataframe in STORE_MODE = "full".
+For the real dataset and synthetic datasets of several times its size, the filtered dataframes of the data store
+scenarios of callback_benchmark.py (full range, year window, lasso, bar click, parcat click) are encoded with every codec.
+Per codec the size of the JSON sent to the browser and the encode and decode time (including the JSON round trip)
+are reported, and all results can be saved as JSON.
+Run from the repository root with:
+    python -m benchmarks.store_codec_benchmark [--scales 1 10 100] [--repeats 5] [--output codecs.json]
+"""
+
+DEFAULT_SCALES = [1, 10, 100]
+
+def _filtered_frames(data) -> list[tuple[str, object]]:
+    # The dataframes the store hands to the plots, obtained by applying the store's compact description to the data
+    callbacks = _register_callbacks(data)
+    store_mode = data_cleaning.STORE_MODE
+    data_cleaning.STORE_MODE = "compact"
+    try:
+        frames = []
+        for scenario in _scenarios(data):
+            state = _call(callbacks["store"], scenario["inputs"] + (PRIMARY_FEATURE, [], None, None), scenario["trigger"])
+            frames.append((scenario["name"], data_cleaning._apply_compact_state(state)))
+        return frames
+    finally:
+        data_cleaning.STORE_MODE = store_mode
+
+def _measure(frame, codec: str, reference, repeats: int) -> dict:
+    encode_times, decode_times = [], []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        payload = to_json_plotly(store_codec.encode(frame, codec))  # As Dash serializes the store value
+        encode_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        store_codec.decode(json.loads(payload), reference)
+        decode_times.append(time.perf_counter() - start)
+    return {"payload_bytes": len(payload), "encode_ms": median(encode_times) * 1000, "decode_ms": median(decode_times) * 1000}
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the payload size and speed of the data store codecs")
+    parser.add_argument("--source", default=data_loader.DEFAULT_SOURCE)
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES)
+    parser.add_argument("--codecs", nargs="+", default=list(store_codec.CODECS))
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="File to save the results to as JSON")
+    args = parser.parse_args()
+
+    codecs = [codec for codec in args.codecs if store_codec.available(codec)]
+    for codec in set(args.codecs) - set(codecs):
+        print(f"Skipping codec {codec}: its package is not installed")
+
+    data = data_loader.load_incidents(args.source)
+    results = []
+    print(f"{'scale':>7} {'rows':>9} {'scenario':<14}{'codec':<10}{'payload (KB)':>14}{'encode (ms)':>13}{'decode (ms)':>13}")
+    for scale in args.scales:
+        synthetic = schema.encode_categories(synthetic_incidents(data, scale, args.seed), plotable_columns + data_cleaning.GROUPABLE_FEATURES)  # As in create_app
+        for scenario, frame in _filtered_frames(synthetic):
+            for codec in codecs:
+                result = {"scale": scale, "rows": len(frame), "scenario": scenario, "codec": codec,
+                          **_measure(frame, codec, synthetic, args.repeats)}
+                results.append(result)
+                print(f"{scale:>6}x {result['rows']:>9} {scenario:<14}{codec:<10}{result['payload_bytes'] / 1024:>14.1f}"
+                      f"{result['encode_ms']:>13.1f}{result['decode_ms']:>13.1f}")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "repeats": args.repeats, "seed": args.seed, "results": results}, file, indent=1)
+        print(f"\nSaved results to {args.output}")
+
+if __name__ == "__main__":
+    main()
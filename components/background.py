@@ -0,0 +1,61 @@
+import os
+import uuid
+from dash import Output
+from . import dataset
+
+try:
+    import diskcache
+    from dash import DiskcacheManager
+except ImportError:  # diskcache (with multiprocess and psutil) is optional; without it every callback runs in the request thread
+    diskcache = None
+
+"""
+Runs the heavy figure callbacks (the map and the parcat plot) as Dash background callbacks.
+A background callback is started in a separate process and the browser polls for its result, so a slow figure build no
+longer holds the request thread of the server process while other users wait.
+The jobs are managed with a local diskcache in the cache folder: no external services (Redis, Celery) are needed.
+Results are kept in that cache by a hash of the callback's inputs, so repeating a view is answered without recomputing it.
+While a figure is being rebuilt its graph gets the RUNNING_CLASS CSS class (see assets/style.css).
+Whatever a job stores in its own process is lost when the job ends, so callbacks that keep state in the server process
+stay synchronous: the data store (memoized stages, session state and coalescer, see data_cleaning.py) and the stacked bar
+chart (figures in the session state). Jobs are forked from the server process, so they do see that state as it was.
+Nothing changes unless enable() is called before the callbacks are registered (see BACKGROUND_CALLBACKS in app.py).
+"""
+
+CACHE_DIR = os.path.join(".cache", "background")
+RESULT_EXPIRE = 600  # Seconds a cached result is kept after it was last used
+RUNNING_CLASS = "graph-updating"
+
+_manager = None
+# Results computed by an earlier run of the app (possibly on other data) must not be reused
+_launch_id = uuid.uuid4().hex
+
+def enable(cache_dir: str = CACHE_DIR) -> bool:
+    '''
+    Makes the callbacks registered from now on run in the background, backed by a diskcache in cache_dir.
+    Returns False (and leaves every callback synchronous) if diskcache is not installed.
+    '''
+    global _manager
+    if diskcache is None:
+        return False
+    # Results computed for an older version of the data (before incidents were added, see ingest.py) are not reused either
+    _manager = DiskcacheManager(diskcache.Cache(cache_dir), cache_by=[lambda: _launch_id, lambda: getattr(dataset.current(), "version", None)],
+                                expire=RESULT_EXPIRE)
+    return True
+
+def enabled() -> bool:
+    return _manager is not None
+
+def callback_options(graph_id: str | None = None) -> dict:
+    '''
+    Returns the extra app.callback arguments that run a heavy callback in the background (none if not enabled).
+    If graph_id is given, that graph shows it is being updated while the callback runs.
+    '''
+    if _manager is None:
+        return {}
+    # The callbacks read ctx.triggered_id (e.g. clicks only count when the plot itself was clicked),
+    # so the trigger has to be part of the cache key
+    options = {"background": True, "manager": _manager, "cache_ignore_triggered": False}
+    if graph_id is not None:
+        options["running"] = [(Output(graph_id, "className"), RUNNING_CLASS, "")]
+    return options
@@ -0,0 +1,84 @@
+import itertools
+import threading
+from dash.exceptions import PreventUpdate
+from .lru_cache import LRUCache
+
+"""
+Drops work that has been superseded by a newer input from the same browser session.
+When a user clicks through stacked-bar segments quickly, the browser only shows the result of the last click, but the
+server would still compute the data store (and every figure depending on it) for each intermediate click.
+Every data store computation therefore gets an increasing version number per session; a computation stops at its next
+checkpoint once a newer one has started, and figure callbacks skip store values once a newer one has been delivered.
+Only delivered values count for the figures: a computation that stops without a value (PreventUpdate or an error)
+leaves the browser with the previous value, which the figures must still accept.
+Versions are kept per server process, so with several worker processes this only coalesces requests that reach the same worker.
+"""
+
+SESSION_LIMIT = 10000  # Maximum number of sessions whose latest version is remembered
+
+class Coalescer:
+    def __init__(self, maxsize: int = SESSION_LIMIT):
+        self._latest = LRUCache(maxsize)  # Session -> version of the newest computation started for it
+        self._delivered = LRUCache(maxsize)  # Session -> version of the newest store value returned for it
+        self._versions = itertools.count(1)
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def begin(self, session: str | None) -> int:
+        '''
+        Registers a new computation for session and returns its version. Newer computations always get higher versions.
+        '''
+        with self._lock:
+            version = next(self._versions)
+            if session is not None:
+                self._latest.put(session, version)
+            return version
+
+    def superseded(self, session: str | None, version: int | None) -> bool:
+        '''
+        Returns whether a newer computation than version has started for session (never for unknown sessions).
+        '''
+        if session is None or version is None:
+            return False
+        return self._latest.get(session, version) > version
+
+    def deliver(self, session: str | None, version: int):
+        '''
+        Records that the computation with version returned its store value, which makes older store values outdated.
+        '''
+        if session is None:
+            return
+        with self._lock:
+            if self._delivered.get(session, 0) < version:
+                self._delivered.put(session, version)
+
+    def outdated(self, session: str | None, version: int | None) -> bool:
+        '''
+        Returns whether a newer store value than version has been delivered for session (never for unknown sessions).
+        '''
+        if session is None or version is None:
+            return False
+        return self._delivered.get(session, version) > version
+
+    def check_value(self, session: str | None, version: int | None):
+        '''
+        Checkpoint for readers of the data store: raises PreventUpdate if the store value is outdated, as the figure
+        will be updated again with the newer value.
+        '''
+        if self.outdated(session, version):
+            with self._lock:
+                self.dropped += 1
+            raise PreventUpdate
+
+    def check(self, session: str | None, version: int | None):
+        '''
+        Checkpoint for long-running work: raises PreventUpdate if the work has been superseded, so the callback stops
+        and the browser keeps its current value until the newer computation answers.
+        '''
+        if self.superseded(session, version):
+            with self._lock:
+                self.dropped += 1
+            raise PreventUpdate
+
+    def stats(self) -> dict:
+        return {"sessions": len(self._latest), "dropped": self.dropped}
@@ -0,0 +1,177 @@
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+from .dataset import Dataset
+from .grouping import LowFreqGrouping
+from .lru_cache import LRUCache
+from .schema import category_codes
+
+"""
+Answers the stacked bar chart's counts per (primary, secondary) value for a year window without touching the rows.
+For every pair of features a cube of incident counts per (year, primary value, secondary value) is built once (on first use),
+with cumulative sums along the years. The counts of a year window are then the difference of two slices of the cube,
+after which low-frequency values are merged into "~Other" exactly as the data store grouped them.
+This only works when every row in the window is selected; with a map selection the bar chart counts the rows instead.
+When incidents are added (see ingest.py), the cubes in memory are updated with the counts of the new rows.
+"""
+
+CUBE_CACHE_SIZE = 16  # Number of (primary, secondary) cubes kept in memory
+
+class YearCountCubes:
+    def __init__(self, base: Dataset, grouping: LowFreqGrouping):
+        self.base = base
+        self.grouping = grouping
+        years = base.years
+        self.boundaries = np.concatenate([[0], np.flatnonzero(years[1:] != years[:-1]) + 1, [len(years)]])  # First row of every year
+        self.row_year = np.repeat(np.arange(len(self.boundaries) - 1), np.diff(self.boundaries))  # Year index of every row
+        self.year_values = years[self.boundaries[:-1]]
+        self._features = {}
+        self._cubes = LRUCache(CUBE_CACHE_SIZE)
+
+    def _feature(self, feature: str) -> dict:
+        # Codes of the feature's values (the same codes as the grouping uses, see schema.category_codes) and, per code,
+        # the rows it occurs in (in row order), to find which value occurs first in a window
+        if feature not in self._features:
+            column = self.base.frame[feature]
+            codes, values = category_codes(column)
+            order = np.argsort(codes, kind="stable")
+            self._features[feature] = {"codes": codes, "values": np.asarray(values), "rows": order,
+                                       "offsets": np.searchsorted(codes[order], np.arange(len(values) + 1)),
+                                       "dtype": column.dtype if isinstance(column.dtype, pd.CategoricalDtype) else None}
+        return self._features[feature]
+
+    def _cube(self, primary: str, secondary: str) -> np.ndarray:
+        cube = self._cubes.get((primary, secondary))
+        if cube is None:
+            n_years = len(self.boundaries) - 1
+            features = [self._feature(primary)] if primary == secondary else [self._feature(primary), self._feature(secondary)]
+            valid = np.all([feature["codes"] >= 0 for feature in features], axis=0)  # Missing values are not counted
+            flat = self.row_year[valid]
+            shape = [n_years]
+            for feature in features:
+                flat = flat * len(feature["values"]) + feature["codes"][valid]
+                shape.append(len(feature["values"]))
+            counts = np.bincount(flat, minlength=int(np.prod(shape))).reshape(shape)
+            cube = np.zeros([n_years + 1] + shape[1:], dtype=np.int32)
+            np.cumsum(counts, axis=0, out=cube[1:])
+            self._cubes.put((primary, secondary), cube)
+        return cube
+
+    def clear(self):
+        '''
+        Drops the cubes and feature codes built so far; they are built again on first use.
+        '''
+        self._features.clear()
+        self._cubes.clear()
+
+    def inserted(self, base: Dataset, grouping: LowFreqGrouping, delta: DataFrame) -> "YearCountCubes":
+        '''
+        Returns the cubes of base, the next version of this dataset with the rows of delta added (see Dataset.inserted).
+        Every cube in memory is updated with the counts of delta, unless a feature of it has values that are not in the cube;
+        those cubes (and all others) are built from the rows again on first use.
+        '''
+        cubes = YearCountCubes(base, grouping)
+        year_index = np.searchsorted(cubes.year_values, self.year_values)  # Position of every existing year among the new years
+        delta_year = np.searchsorted(cubes.year_values, delta["Incident.year"].to_numpy())
+        delta_codes = {}
+        for (primary, secondary), cube in self._cubes.items():
+            features = [primary] if primary == secondary else [primary, secondary]
+            for feature in features:
+                if feature not in delta_codes:
+                    delta_codes[feature] = self._delta_codes(feature, delta[feature], base.frame[feature])
+            if any(delta_codes[feature] is None for feature in features):
+                continue
+            counts = np.zeros((len(cubes.year_values),) + cube.shape[1:], dtype=np.int32)
+            counts[year_index] = np.diff(cube, axis=0)  # Counts per year (the cube holds cumulative counts)
+            valid = np.all([delta_codes[feature] >= 0 for feature in features], axis=0)
+            np.add.at(counts, (delta_year[valid],) + tuple(delta_codes[feature][valid] for feature in features), 1)
+            updated = np.zeros((len(counts) + 1,) + counts.shape[1:], dtype=np.int32)
+            np.cumsum(counts, axis=0, out=updated[1:])
+            cubes._cubes.put((primary, secondary), updated)
+        return cubes
+
+    def _delta_codes(self, feature: str, values: pd.Series, new_column: pd.Series) -> np.ndarray | None:
+        # Codes of the added values in this cube's value order, or None if the order has changed (new values or categories)
+        info = self._feature(feature)
+        if info["dtype"] is not None:
+            if new_column.dtype != info["dtype"]:
+                return None
+            return values.cat.codes.to_numpy()
+        codes = pd.Index(info["values"]).get_indexer(values)
+        return None if ((codes == -1) & values.notna().to_numpy()).any() else codes
+
+    def _groups(self, feature: str, rows: tuple[int, int], low_freq: dict) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        '''
+        Returns, for the values of feature, the index of the group (label) each value belongs to after grouping,
+        the group labels, and the first row of each group in the window (len(base) if it does not occur).
+        '''
+        info = self._feature(feature)
+        labels = info["values"]
+        if feature in self.grouping.labels and len(low_freq.get(feature, [])) > 0:
+            # Same labels as LowFreqGrouping.grouped_columns: the values as text, low-frequency values as "~Other"
+            lookup = np.arange(len(labels))
+            if self.grouping.groupable[feature]:
+                lookup[low_freq[feature]] = len(labels)
+            labels = self.grouping.labels[feature][lookup]
+        group_of_value, group_labels = pd.factorize(labels)
+        first = np.full(len(labels), len(self.base))
+        for code in range(len(labels)):
+            code_rows = info["rows"][info["offsets"][code]:info["offsets"][code + 1]]
+            index = np.searchsorted(code_rows, rows[0])
+            if index < len(code_rows) and code_rows[index] < rows[1]:
+                first[code] = code_rows[index]
+        group_first = np.full(len(group_labels), len(self.base))
+        np.minimum.at(group_first, group_of_value, first)
+        return group_of_value, np.asarray(group_labels), group_first
+
+    def combinations(self, primary: str, secondary: str, rows: tuple[int, int], low_freq: dict, normalize: bool) -> DataFrame | None:
+        '''
+        Returns the same dataframe the stacked bar chart computes from the rows (before sorting): the count (or proportion)
+        of every (primary, secondary) combination in the window, or of every primary value if primary == secondary.
+        Returns None if the row range is not a year window or one of the features has missing values.
+        '''
+        start, stop = (int(np.searchsorted(self.boundaries, row)) for row in rows)
+        if start >= len(self.boundaries) or stop >= len(self.boundaries) or \
+                self.boundaries[start] != rows[0] or self.boundaries[stop] != rows[1]:
+            return None
+        if (self._feature(primary)["codes"] < 0).any() or (self._feature(secondary)["codes"] < 0).any():
+            return None  # The chart shows missing values as a bar of their own in the stacked case; count the rows instead
+        cube = self._cube(primary, secondary)
+        window_counts = cube[stop] - cube[start]
+        y_feature = 'proportion' if normalize else 'count'
+
+        primary_group, primary_labels, primary_first = self._groups(primary, rows, low_freq)
+        if primary == secondary:
+            counts = np.bincount(primary_group, weights=window_counts, minlength=len(primary_labels)).astype(np.int64)
+            present = np.flatnonzero(counts > 0)
+            present = present[np.argsort(self._sort_keys(primary, primary_labels[present]), kind="stable")]  # groupby sorts by value
+            values = np.ones(len(present)) if normalize else counts[present]
+            return DataFrame({primary: self._column(primary, primary_labels[present]), y_feature: values})
+
+        secondary_group, secondary_labels, secondary_first = self._groups(secondary, rows, low_freq)
+        counts = np.zeros((len(primary_labels), len(secondary_labels)), dtype=np.int64)
+        np.add.at(counts, (primary_group[:, None], secondary_group[None, :]), window_counts)
+        # Values in order of first occurrence in the window, like drop_duplicates in the chart's cross merge
+        primary_present = np.flatnonzero(primary_first < len(self.base))
+        primary_present = primary_present[np.argsort(primary_first[primary_present], kind="stable")]
+        secondary_present = np.flatnonzero(secondary_first < len(self.base))
+        secondary_present = secondary_present[np.argsort(secondary_first[secondary_present], kind="stable")]
+        counts = counts[np.ix_(primary_present, secondary_present)]
+        if normalize:
+            totals = counts.sum(axis=1, keepdims=True)
+            values = np.divide(counts, totals, out=np.zeros(counts.shape), where=totals > 0)
+        else:
+            values = counts
+        return DataFrame({primary: self._column(primary, np.repeat(primary_labels[primary_present], len(secondary_present))),
+                          secondary: self._column(secondary, np.tile(secondary_labels[secondary_present], len(primary_present))),
+                          y_feature: values.ravel()})
+
+    def _sort_keys(self, feature: str, labels: np.ndarray) -> np.ndarray:
+        # Categorical features sort in their canonical order, others by value
+        dtype = self._feature(feature)["dtype"]
+        return labels if dtype is None else dtype.categories.get_indexer(labels)
+
+    def _column(self, feature: str, labels: np.ndarray):
+        # Same type as the column the chart would otherwise count (categorical features stay categorical)
+        dtype = self._feature(feature)["dtype"]
+        return labels if dtype is None else pd.Categorical(labels, dtype=dtype)
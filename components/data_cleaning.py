@@ -1,6 +1,22 @@
+import base64
+import hashlib
+import itertools
+import json
+import os
+import numpy as np
 import pandas as pd
 from pandas import DataFrame
-from dash import Dash, Input, Output, State, dcc, ctx
+from dash import Dash, Input, Output, State, dcc, html, ctx
+from dash.exceptions import PreventUpdate
+from .coalescing import Coalescer
+from .count_cube import YearCountCubes
+from .lru_cache import LRUCache
+from .session_state import SessionState
+from .store_pipeline import StorePipeline
+from .spatial import GridIndex
+from . import data_loader, dataset, schema, store_codec
+from .dataset import Dataset
+from .grouping import LowFreqGrouping
 
 """
 In the new "centralized dataframe" architecture, this component is responsible for
@@ -19,96 +35,391 @@ GROUPABLE_FEATURES = ["Incident.year", "Site.category", "No.sharks", "Victim.act
                       "Data.source", "Shark.name"]  
 
 # Custom sort order for month
-MONTH_ORDER = {'JAN': 1, 'FEB': 2, 'MAR': 3, 'APR': 4, 'MAY': 5, 'JUN': 6, 'JUL': 7, 'AUG': 8, 'SEP': 9, 'OCT': 10, 'NOV': 11, 'DEC': 12}
+# (the components sort on the canonical category order of the loaded data instead, see schema.py)
+MONTH_ORDER = {month: number for number, month in enumerate(schema.MONTHS, start=1)}
 
 # Opacity of points not selected on the map
 UNSELECTED_OPACITY = 0.05
 GRAYED_OUT_COLOR = '#bababa'
 
+# How the filtered dataframe is handed to the plots:
+# "full"    - the whole dataframe is serialized into the dcc.Store and sent to the browser and back (original behaviour)
+# "server"  - the dcc.Store only holds a small versioned key; the dataframe itself stays in the session's server-side state
+# "compact" - the dcc.Store holds a compact description of the filtering (year-window row range, selection bitmask,
+#             codes of the grouped low-frequency values and highlight codes), which the plots apply to the shared base dataframe
+STORE_MODE = "compact"
+# How the dataframe is encoded in "full" mode: "records" (the original DataFrame.to_dict()), "columns", "arrow" or "msgpack"
+# (see store_codec.py; run `python -m benchmarks.store_codec_benchmark` to compare them)
+STORE_CODEC = "arrow"
+# One store update is read by several plots; the first one to read it decodes the dataframe and the others reuse it.
+# Decoded dataframes are kept by the content fingerprint the store embeds (see write_store).
+DECODED_FRAME_CACHE_SIZE = 8
+
+_decoded_frames = LRUCache(DECODED_FRAME_CACHE_SIZE)
+_store_versions = itertools.count(1)
+
+# Versions of the data store computations per browser session, so superseded work can be dropped (see coalescing.py)
+coalescer = Coalescer()
+# Interaction state kept on the server per browser session, within a TTL and a global memory budget (see session_state.py):
+# the filtered dataframes of "server" mode, the latest result of every data store stage and the stacked bar figures
+session_state = SessionState()
+# The data store computation as memoized stages (year window, selection, grouping, highlight); see pipeline.stats() for stage timings
+pipeline = StorePipeline(session_state)
+# Gives every page load (browser tab) its own random session id
+NEW_SESSION_JS = "function(id) { return Math.random().toString(36).slice(2) + Date.now().toString(36); }"
+# Sends only the geometry of a box/lasso selection on the map to the server (instead of a record for every selected point);
+# selections without geometry fall back to the UIDs of the selected points
+MAP_SELECTION_JS = """
+function(selected) {
+    if (!selected) { return null; }
+    if (selected.range || selected.lassoPoints) { return {range: selected.range, lassoPoints: selected.lassoPoints}; }
+    return {points: (selected.points || []).map(function(point) { return {customdata: [point.customdata[0]]}; })};
+}
+"""
+
 app = Dash(__name__)
 
-def store(app: Dash, id: str, all_data: DataFrame)-> dcc.Store:
+def prepare_dataset(all_data: DataFrame, version: int = 0) -> Dataset:
+    '''
+    Returns the shared (year-sorted) base dataset with the structures derived from it that the store and the plots use.
+    '''
+    base = Dataset(all_data, version)  # See dataset.py
+    base.grouping = LowFreqGrouping(base.frame, GROUPABLE_FEATURES)  # Integer codes of the groupable features, see grouping.py
+    base.grouping.codes = data_loader.memory_mapped("grouping_codes", base.grouping.codes)  # Shared between server processes
+    base.spatial_index = GridIndex(base.frame["Latitude"].to_numpy(), base.frame["Longitude"].to_numpy())  # For map selections, see spatial.py
+    base.count_cubes = YearCountCubes(base, base.grouping)  # Stacked bar counts per year window, see count_cube.py
+    return base
+
+def extend_dataset(base: Dataset, delta: DataFrame) -> Dataset:
+    '''
+    Returns the next version of base with the incidents of delta added (see ingest.py), updating the derived structures
+    with the new rows instead of building them again. delta must have the columns and types of the base frame.
+    base itself is not changed, so callbacks still using it are not affected.
+    '''
+    delta = delta.sort_values("Incident.year", kind="stable").reset_index(drop=True)
+    frame, delta, _ = schema.extend_categories(base.frame, delta)  # New values get categories of their own
+    extended, slots = base.inserted(delta, frame)
+    grouping = base.grouping.inserted(slots, delta)
+    if grouping is None:  # Values without a code yet; their codes (and so all codes after them) change
+        grouping = LowFreqGrouping(extended.frame, GROUPABLE_FEATURES)
+    extended.grouping = grouping
+    extended.grouping.codes = data_loader.memory_mapped("grouping_codes", grouping.codes)
+    extended.spatial_index = base.spatial_index.inserted(slots, delta["Latitude"].to_numpy(), delta["Longitude"].to_numpy())
+    extended.count_cubes = base.count_cubes.inserted(extended, extended.grouping, delta)
+    return extended
+
+def store(app: Dash, id: str, all_data: DataFrame)-> html.Div:
+    dataset.set_current(prepare_dataset(all_data))
+
     @app.callback(
         Output("data_store", "data"),
-        [Input("map", "selectedData"),
+        [Input("map_selection", "data"),
          Input("slider", "value"),
          Input("stacked_bar", "clickData"),
          Input("parcat", "clickData"),
          Input("clear_selection_button", "n_clicks"),
          State("primary_color_dropdown", "value"),
-         State("secondary_color_dropdown", "value")]
+         State("secondary_color_dropdown", "value"),
+         State("session_id", "data"),
+         State("parcat_paths", "data")]
+        # Always runs in the server process, also with background callbacks (see background.py): the memoized stages,
+        # the session state and the coalescer versions would be lost with the process of a background job
     )
-    def filter_dataframe(map_selected_data, input_year, bar_clicked, parcat_clicked, clear_selection_button, primary_color_feature, secondary_color_feature):
-        filtered_data = all_data.copy()
+    def filter_dataframe(map_selected_data, input_year, bar_clicked, parcat_clicked, clear_selection_button, primary_color_feature, secondary_color_feature, session, parcat_paths):
         trigger = ctx.triggered_id  # Find out which figure was clicked
+        version = coalescer.begin(session)  # Any newer input from this session supersedes this computation
+        base = dataset.current()  # One version of the data for the whole computation, even if new incidents arrive meanwhile
+        # Every stage below is memoized per session on its own inputs (plus the key of the stage before it, see store_pipeline.py):
+        # a bar or parcat click only recomputes the highlight stage, and a new year window reuses the resolved map selection.
 
         ### Filter based on map selection & timescale ###
         # Note: "selected" is the opacity value the point should have on the map (1 if selected, 0.05 if not)
         # Timescale selection
         # "Hard-filter" version: points outside the selected year range are outright removed from the dataframe
-        filtered_data = filtered_data.loc[(filtered_data['Incident.year'] >= input_year[0]) & (filtered_data['Incident.year'] <= input_year[1])]
+        # (the base data is sorted by year, so this is a range of rows)
+        window_key = (base.version, tuple(input_year))
+        rows = pipeline.run(session, "window", window_key, lambda: base.year_rows(input_year[0], input_year[1]))
         # "Soft-filter" version: points outside the selected year range are set to selected = 0
         #filtered_data['selected'] = filtered_data['Incident.year'].apply(lambda year: 1 if (year >= input_year[0] and year <= input_year[1]) else UNSELECTED_OPACITY)
-        # Map selection
-        if(map_selected_data is None):
-            filtered_data['selected'] = [1]*len(filtered_data)  # In this case all data is selected
-        else:
-            #print("MAP DATA: ", [point['customdata'][0] for point in map_selected_data['points']])  # TEST
-            selected_ids = [point['customdata'][0] for point in map_selected_data['points']]  # Row numbers of selected points
-            filtered_data['selected'] = filtered_data['UID'].apply(lambda id: 1 if id in selected_ids else UNSELECTED_OPACITY) 
+        # Map selection: a boolean mask over all rows (None if all data is selected), so it does not depend on the year window
+        selection_key = (base.version, None if map_selected_data is None else json.dumps(map_selected_data, sort_keys=True))
+        selected = pipeline.run(session, "selection", selection_key,
+                                lambda: None if map_selected_data is None else _selection_mask(base, map_selected_data))
+        coalescer.check(session, version)
 
         ### Group low-frequency points ###
         # Group low-frequency points into an "other" category to reduce clutter (particularly in the bar and PC plots) 
         # Which features are considered groupable is defined above.
-        for feature in GROUPABLE_FEATURES:
-            filtered_data = filter_low_freq(filtered_data, feature)
+        # All features are counted in a single pass over their integer codes (see grouping.py; filter_low_freq does the same for one feature).
+        grouping_key = (window_key, selection_key)
+        filtered_data, grouped_values = pipeline.run(session, "grouping", grouping_key, lambda: _grouped_window(base, rows, selected))
+        coalescer.check(session, version)
 
         ### Highlight based on clicked bar in barplot or PCP ###
-        # Note: "highlighted" is the color the point should have in all plots (colored if highlighted, grey (#bababa) otherwise)
-        # User clicked on barplot bar
-        if trigger == "stacked_bar":
-            color_index = bar_clicked["points"][0]["curveNumber"]  # Index of bar (default) or trace (stacked) in bar chart
-            selected_color = PLOTLY_DEFAULT_COLORS[color_index % len(PLOTLY_DEFAULT_COLORS)]  # Actual selected color
-            selected_x_value = bar_clicked["points"][0]["x"] # x feature value corresponding to the selected (sub-)bar
-
-            # Default bar chart
-            if(secondary_color_feature is None or secondary_color_feature == []):
-                filtered_data["highlighted"] = filtered_data[primary_color_feature].apply(lambda x : selected_color if x == selected_x_value else GRAYED_OUT_COLOR)  # Select incidents to highlight
-
-            # Stacked bar chart
-            else:
-                color_names = filtered_data[secondary_color_feature].value_counts().index.tolist()  # Unique values for barplot color feature
-                color_names = sorted(color_names)  # Sort alphabetically
-                selected_color_value = color_names[color_index]  # Color feature value corresponding to the selected sub-bar
-                filtered_data["highlighted"] = filtered_data.apply(lambda row : selected_color if (row[primary_color_feature] == selected_x_value and row[secondary_color_feature] == selected_color_value) else GRAYED_OUT_COLOR, axis=1)
-        
-        # User clicked on parcat bar
-        elif trigger == "parcat":
-            #print("PARCAT POINTS CLICKED:", [point['pointNumber'] for point in parcat_clicked['points']])  # TEST
-            # For a variety of reasons, getting the color of whatever you clicked in the PCP is very hard.
-            # That's why we instead use the unique "brushing color" below, which is exclusive to the PCP to highlight points.
-            brushing_color = '#FFFFFF'
-            clicked_points = [point['pointNumber'] for point in parcat_clicked['points']]  # This is the indices of the points which have been clicked
-            # Problem: the numbers here are the indices of *only the selected points, renumbered from 0*. That's why we have to do this roundabout shit:
-            selected_UIDs = filtered_data.loc[filtered_data['selected'] == 1, 'UID'].reset_index()  # Get UIDs of selected points & renumber them
-            selected_UIDs = selected_UIDs.loc[selected_UIDs.index.isin(clicked_points), 'UID'].tolist()  # Keep only the ones that were clicked in the PCP
-            filtered_data['highlighted'] = filtered_data['UID'].apply(lambda uid: brushing_color if (uid in selected_UIDs) else GRAYED_OUT_COLOR)  # Color only clicked points (determined by UID)
-        
-        # User clicked on clear selection button: clear both map selection and highlights
-        elif trigger == "clear_selection_button":
-            filtered_data['selected'] = [1]*len(filtered_data)
-            filtered_data['highlighted'] = [GRAYED_OUT_COLOR]*len(filtered_data)
-
-        # User clicked something else: clear highlights
-        else:
-            filtered_data['highlighted'] = [GRAYED_OUT_COLOR]*len(filtered_data)
+        # The memoized grouped dataframe is shared with later calls, so the highlight stage returns a new dataframe instead of changing it
+        highlight_key = (grouping_key,) + _highlight_inputs(trigger, bar_clicked, parcat_clicked, primary_color_feature, secondary_color_feature, parcat_paths)
+        filtered_data, highlight = pipeline.run(session, "highlight", highlight_key,
+                                                lambda: _highlighted(filtered_data, trigger, bar_clicked, parcat_clicked, primary_color_feature, secondary_color_feature, parcat_paths))
 
         # Return data with correct filtering/highlighting
-        return filtered_data.to_dict()  # Note: data is stored as JSON, so it has to be converted to JSON and then converted back when reading it in another component
+        coalescer.check(session, version)
+        value = write_store(filtered_data, rows, grouped_values, session, version, base.version, highlight)
+        coalescer.deliver(session, version)  # From now on, the figures skip older store values of this session
+        return value
+
+    app.clientside_callback(NEW_SESSION_JS, Output("session_id", "data"), Input("session_id", "id"))
+    app.clientside_callback(MAP_SELECTION_JS, Output("map_selection", "data"), Input("map", "selectedData"))
+    return html.Div(children=[dcc.Store(id=id), dcc.Store(id="session_id"), dcc.Store(id="map_selection")])
+
+def _selection_mask(base: Dataset, map_selected_data: dict) -> np.ndarray:
+    '''
+    Returns a boolean mask over all rows of the base data that is True for the incidents selected on the map.
+    Box and lasso selections are resolved from their geometry with the spatial index; other selections use the UIDs
+    of the selected points.
+    '''
+    mask = np.zeros(len(base), dtype=bool)
+    if (map_selected_data.get("range") or {}).get("map"):
+        (west, north), (east, south) = map_selected_data["range"]["map"]  # Corners as [longitude, latitude]
+        mask[base.spatial_index.in_box(min(west, east), min(south, north), max(west, east), max(south, north))] = True
+        return mask
+    if (map_selected_data.get("lassoPoints") or {}).get("map"):
+        mask[base.spatial_index.in_polygon(np.array(map_selected_data["lassoPoints"]["map"]))] = True
+        return mask
+    selected_ids = [point['customdata'][0] for point in map_selected_data.get('points', [])]  # UIDs of selected points
+    return base.uid_mask(selected_ids)  # Looked up in the UID index instead of searching the list for every row
+
+def _grouped_window(base: Dataset, rows: tuple[int, int], selected: np.ndarray | None) -> tuple[DataFrame, dict]:
+    '''
+    Returns the rows of the year window with the "selected" column and the low-frequency values grouped into "~Other",
+    and the codes of the grouped values per feature. selected is a boolean mask over all rows (None means all are selected).
+    '''
+    filtered_data = base.frame.iloc[rows[0]:rows[1]].copy(deep=False)  # A shallow copy avoids copying the columns themselves
+    if selected is None:
+        filtered_data['selected'] = 1  # In this case all data is selected
+    else:
+        selected = selected[rows[0]:rows[1]]
+        filtered_data['selected'] = np.where(selected, 1, UNSELECTED_OPACITY)
+    grouped_values = base.grouping.low_freq_codes(rows, selected)
+    return filtered_data.assign(**base.grouping.grouped_columns(rows, grouped_values)), grouped_values
+
+def _highlighted(filtered_data: DataFrame, trigger: str | None, bar_clicked: dict | None, parcat_clicked: dict | None,
+                 primary_color_feature: str, secondary_color_feature, parcat_paths: dict | None) -> tuple[DataFrame, tuple]:
+    '''
+    Returns the filtered dataframe with the "highlighted" column for the clicked bar in the barplot or paths in the PCP,
+    and the palette and codes of that column (see _with_highlight).
+    '''
+    # Note: "highlighted" is the color the point should have in all plots (colored if highlighted, grey (#bababa) otherwise)
+    # User clicked on barplot bar
+    if trigger == "stacked_bar":
+        color_index = bar_clicked["points"][0]["curveNumber"]  # Index of bar (default) or trace (stacked) in bar chart
+        selected_color = PLOTLY_DEFAULT_COLORS[color_index % len(PLOTLY_DEFAULT_COLORS)]  # Actual selected color
+        selected_x_value = bar_clicked["points"][0]["x"] # x feature value corresponding to the selected (sub-)bar
+
+        # Default bar chart
+        if(secondary_color_feature is None or secondary_color_feature == []):
+            highlighted = (filtered_data[primary_color_feature] == selected_x_value).to_numpy()  # Select incidents to highlight
+
+        # Stacked bar chart
+        else:
+            color_names = schema.observed_values(filtered_data[secondary_color_feature])  # Unique values for barplot color feature, in the chart's (canonical) order
+            selected_color_value = color_names[color_index]  # Color feature value corresponding to the selected sub-bar
+            highlighted = ((filtered_data[primary_color_feature] == selected_x_value) & (filtered_data[secondary_color_feature] == selected_color_value)).to_numpy()
+        return _with_highlight(filtered_data, highlighted, selected_color)
+
+    # User clicked on parcat bar
+    if trigger == "parcat":
+        # For a variety of reasons, getting the color of whatever you clicked in the PCP is very hard.
+        # That's why we instead use the unique "brushing color" below, which is exclusive to the PCP to highlight points.
+        brushing_color = '#FFFFFF'
+        clicked_points = np.array([point['pointNumber'] for point in parcat_clicked['points']], dtype=int)  # This is the indices of the points which have been clicked
+        # Problem: the numbers here are the indices of *only the selected points, renumbered from 0*,
+        # so we translate them to row positions through the positions of the selected rows.
+        selected_rows = np.flatnonzero(filtered_data['selected'].to_numpy() == 1)
+        highlighted = np.zeros(len(filtered_data), dtype=bool)
+        if parcat_paths is None:
+            clicked_points = clicked_points[(clicked_points >= 0) & (clicked_points < len(selected_rows))]
+            highlighted[selected_rows[clicked_points]] = True
+        else:
+            # The parcat plot draws one weighted path per distinct combination of values (see parcat_component.py),
+            # so the numbers are path indices; the plot stores which path every selected point belongs to.
+            if parcat_paths["points"] != len(selected_rows):  # Drawn from a different selection; wait for the plot to catch up
+                raise PreventUpdate
+            path_codes = decode_codes(parcat_paths["codes"], len(selected_rows), parcat_paths["paths"])
+            highlighted[selected_rows[np.isin(path_codes, clicked_points)]] = True
+        return _with_highlight(filtered_data, highlighted, brushing_color)  # Color only clicked points
+
+    # User clicked on clear selection button: clear both map selection and highlights
+    # (the grouping stays as computed for the map selection, until the cleared selection arrives from the map)
+    if trigger == "clear_selection_button":
+        return _with_highlight(filtered_data.assign(selected=1), None)
+
+    # User clicked something else: clear highlights
+    return _with_highlight(filtered_data, None)
+
+def _highlight_inputs(trigger: str | None, bar_clicked: dict | None, parcat_clicked: dict | None,
+                      primary_color_feature: str, secondary_color_feature, parcat_paths: dict | None) -> tuple:
+    '''
+    Returns the inputs the highlight depends on for the given trigger, as (part of) the key of the highlight stage.
+    '''
+    if trigger == "stacked_bar":
+        return (trigger, json.dumps(bar_clicked, sort_keys=True), primary_color_feature, secondary_color_feature)
+    if trigger == "parcat":
+        return (trigger, json.dumps(parcat_clicked, sort_keys=True), json.dumps(parcat_paths, sort_keys=True))
+    return ("clear_selection_button" if trigger == "clear_selection_button" else None,)  # Nothing is highlighted
+
+def _with_highlight(filtered_data: DataFrame, highlighted: np.ndarray | None, color: str | None = None) -> tuple[DataFrame, tuple]:
+    '''
+    Returns the filtered dataframe with the "highlighted" column: the given color for the highlighted rows, grey otherwise
+    (None means nothing is highlighted). Also returns the palette of that column (grey first) and the code of every row
+    in it (None if everything is grey), so the store does not have to derive them from the column again.
+    '''
+    if highlighted is None or not highlighted.any():
+        return filtered_data.assign(highlighted=GRAYED_OUT_COLOR), ([GRAYED_OUT_COLOR], None)
+    palette, codes = [GRAYED_OUT_COLOR, color], highlighted.astype(np.uint8)
+    return filtered_data.assign(highlighted=_palette_column(palette, codes)), (palette, codes)
+
+def write_store(filtered_data: DataFrame, rows: tuple[int, int], grouped_values: dict, session: str | None = None, version: int | None = None,
+                dataset_version: int = 0, highlight: tuple | None = None) -> dict:
+    '''
+    Converts the filtered dataframe into the value that is put in the dcc.Store, depending on STORE_MODE.
+    In "server" mode the dataframe is kept in the session's server-side state and only its key is returned.
+    In "compact" mode only the row range of the base data (of the given dataset version), the selection/highlight codes and the grouped values are returned.
+    Both also record the session and version of the computation, so readers can skip values that are already outdated.
+    The "compact" and "full" values carry a fingerprint of their contents, under which readers share the decoded dataframe.
+    In "full" mode the dataframe itself is encoded with STORE_CODEC (see store_codec.py).
+    highlight is the palette and codes of the "highlighted" column if they are already known (see _with_highlight).
+    '''
+    if STORE_MODE == "server":
+        key = "{}-{}".format(os.getpid(), next(_store_versions))  # Unique per process, increasing per update
+        session_state.put(session, ("store", key), filtered_data)
+        return {"key": key, "session": session, "version": version}
+    state = _compact_state(filtered_data, rows, grouped_values, dataset_version, highlight)
+    if STORE_MODE == "compact":
+        return {**state, "fingerprint": _content_fingerprint(state), "session": session, "version": version}
+    # Note: data is stored as JSON, so the dataframe is encoded with STORE_CODEC and decoded again when reading it in another component.
+    # The filtered dataframe follows from its compact description, so that is fingerprinted instead of the whole dataframe.
+    return {"fingerprint": _content_fingerprint(state), "selection_fingerprint": selection_fingerprint(state),
+            **store_codec.encode(filtered_data, STORE_CODEC)}
+
+def read_store(data: dict | None, all_data: DataFrame) -> DataFrame:
+    '''
+    Converts the value of the dcc.Store back into a dataframe. Used by all components reading the data store.
+    The returned dataframe may be shared between components, so it should not be modified in place.
+    '''
+    current = dataset.current()
+    if current is not None:  # Includes the incidents added since all_data was loaded, with their categories (see ingest.py)
+        all_data = current.frame
+    if data is None:
+        return DataFrame(all_data)
+    coalescer.check_value(data.get("session"), data.get("version"))  # Stops here if a newer store value has been delivered
+    if "rows" in data:
+        return _decoded_frames.get_or_compute(data.get("fingerprint") or _content_fingerprint(data), lambda: _apply_compact_state(data))
+    if "codec" in data:
+        return _decoded_frames.get_or_compute(data["fingerprint"], lambda: store_codec.decode(data, all_data))
+    if "key" in data:
+        filtered_data = session_state.get(data.get("session"), ("store", data["key"]))
+        if filtered_data is None:  # Expired, evicted (or stored by another server process); keep showing the current figure
+            raise PreventUpdate
+        return filtered_data
+    return schema.restore_categories(DataFrame(data), all_data)  # Store value without a fingerprint; convert stored JSON to dataframe
+
+def _palette_column(palette: list[str], codes: np.ndarray):
+    '''
+    Turns the code of every row into the color at that position in palette, as the values of the "highlighted" column.
+    Taking from the (tiny) array of palette colors avoids converting a color string per row.
+    '''
+    return pd.Series(palette).array.take(codes.astype(np.intp))
+
+def selection_fingerprint(data: dict | None) -> str | None:
+    '''
+    Returns a short fingerprint of the rows, selection and grouping described by the store value (ignoring highlights),
+    so plots that do not show highlights can use it as a cache key.
+    '''
+    if data is None:
+        return None
+    if "key" in data:  # Server-side store keys are already unique
+        return data["key"]
+    if "selection_fingerprint" in data:  # Encoded dataframe; computed from its compact description when it was written
+        return data["selection_fingerprint"]
+    if "rows" in data:
+        content = {key: data.get(key) for key in ("dataset", "rows", "selection", "other")}
+    else:
+        content = {column: values for column, values in data.items() if column != "highlighted"}
+    return hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+def _content_fingerprint(state: dict) -> str:
+    '''
+    Returns a fingerprint of everything a (compact) store value describes: rows, selection, grouping and highlights.
+    '''
+    content = {key: state.get(key) for key in ("dataset", "rows", "selection", "other", "highlight")}
+    return hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+### Compact store contents ###
+# The selection and highlight are stored as one code per row of the year window, packed into a base64 string.
+# Selection codes are 0/1 (unselected/selected); highlight codes index into a small palette of colors (0 is always grey).
+def _compact_state(filtered_data: DataFrame, rows: tuple[int, int], grouped_values: dict, dataset_version: int = 0,
+                   highlight: tuple | None = None) -> dict:
+    selected = filtered_data['selected'].to_numpy() == 1
+    if highlight is None:  # Derive the palette and codes from the column
+        highlighted = filtered_data['highlighted']
+        palette = [GRAYED_OUT_COLOR] + sorted(set(highlighted) - {GRAYED_OUT_COLOR})
+        codes = pd.Categorical(highlighted, categories=palette).codes
+    else:
+        palette, codes = highlight
+    return {
+        "dataset": dataset_version,  # The rows and codes refer to this version of the base data
+        "rows": list(rows),
+        "selection": None if selected.all() else encode_codes(selected, 2),  # None means everything is selected
+        "other": grouped_values,
+        "highlight": None if len(palette) == 1 else {"palette": palette,
+                                                     "codes": encode_codes(codes, len(palette))}
+    }
+
+def _apply_compact_state(state: dict) -> DataFrame:
+    base = dataset.get(state.get("dataset"))
+    if base is None:  # Written for a version of the data that is no longer kept; the store is recomputed for the new one
+        raise PreventUpdate
+    start, stop = state["rows"]
+    filtered_data = base.frame.iloc[start:stop].copy(deep=False)  # Shallow copy: the base columns are shared, not copied
+
+    if state["selection"] is None:
+        filtered_data['selected'] = 1
+    else:
+        selected = decode_codes(state["selection"], stop - start, 2)
+        filtered_data['selected'] = np.where(selected == 1, 1, UNSELECTED_OPACITY)
+
+    filtered_data = filtered_data.assign(**base.grouping.grouped_columns((start, stop), state["other"]))
+
+    if state["highlight"] is None:
+        filtered_data['highlighted'] = GRAYED_OUT_COLOR
+    else:
+        palette = state["highlight"]["palette"]
+        codes = decode_codes(state["highlight"]["codes"], stop - start, len(palette))
+        filtered_data['highlighted'] = _palette_column(palette, codes)
+    return filtered_data
+
+def encode_codes(codes: np.ndarray, palette_size: int) -> str:
+    '''
+    Packs codes (0 <= code < palette_size, one per row) into a base64 string, using as few bytes per row as the palette allows.
+    '''
+    if palette_size <= 2:
+        packed = np.packbits(codes.astype(bool))  # One bit per row
+    else:
+        packed = codes.astype(_code_dtype(palette_size))  # One byte per row for up to 256 codes
+    return base64.b64encode(packed.tobytes()).decode("ascii")
+
+def decode_codes(text: str, length: int, palette_size: int) -> np.ndarray:
+    if palette_size <= 2:
+        return np.unpackbits(np.frombuffer(base64.b64decode(text), dtype=np.uint8), count=length)
+    return np.frombuffer(base64.b64decode(text), dtype=_code_dtype(palette_size))[:length]
 
-    return dcc.Store(id=id)
+def _code_dtype(palette_size: int) -> type:
+    if palette_size <= 256:
+        return np.uint8
+    return np.uint16 if palette_size <= 65536 else np.uint32
 
 # Auxiliary function for grouping low-frequency categories into "other"
+# Note: the store uses the equivalent LowFreqGrouping (grouping.py), which groups all features at once on integer codes.
 def filter_low_freq(data: DataFrame, feature: str) -> DataFrame:
     '''
     Groups low-frequency values for the given feature into a category "other" to reduce data clutter.
@@ -0,0 +1,145 @@
+import glob
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+try:
+    import pyarrow.feather as feather
+except ImportError:  # pyarrow is optional; without it we simply parse the Excel file on every start
+    feather = None
+
+"""
+Loads the incident dataset.
+Parsing sharks_clean.xlsx is by far the slowest part of starting the app, so the first time the data is loaded
+we write a typed, uncompressed Arrow (Feather) copy of the cleaned dataframe to a cache folder.
+On later starts that copy is memory-mapped instead of parsing the Excel file again.
+The cache is rebuilt automatically whenever the source file changes (checked by modification time and size, and by hash if those differ).
+Because the data (and, through memory_mapped, the arrays derived from it) is read from memory-mapped files, several
+server processes share one copy of it in the operating system's page cache instead of each holding a private copy.
+"""
+
+DEFAULT_SOURCE = "sharks_clean.xlsx"
+CACHE_DIR = ".cache"
+CACHE_FORMAT_VERSION = 1  # Bump this whenever _clean changes, so old caches are not reused
+DELTA_READERS = {".csv": pd.read_csv, ".parquet": pd.read_parquet}  # File types of new incidents (see ingest.py)
+
+def load_incidents(source: str = DEFAULT_SOURCE, cache_dir: str = CACHE_DIR, use_cache: bool = True) -> DataFrame:
+    '''
+    Returns the cleaned incident dataframe, reading it from the columnar cache if that is still up to date.
+    Falls back to parsing the source file directly if pyarrow is not installed or use_cache is False.
+    '''
+    if not use_cache or feather is None:
+        return read_source(source)
+
+    data_path, meta_path = _cache_paths(source, cache_dir)
+    source_stat = _source_stat(source)
+    meta = _read_meta(meta_path)
+    if meta is not None and os.path.exists(data_path):
+        if _same_stat(meta, source_stat):
+            return _read_cache(data_path)
+        # File was touched or copied; only rebuild if its contents actually changed
+        source_stat["sha256"] = _file_hash(source)
+        if meta.get("sha256") == source_stat["sha256"]:
+            _write_meta(meta_path, source_stat)
+            return _read_cache(data_path)
+
+    data = read_source(source)
+    if "sha256" not in source_stat:
+        source_stat["sha256"] = _file_hash(source)
+    _write_cache(data, data_path, meta_path, source_stat)
+    return data
+
+def memory_mapped(name: str, array: np.ndarray, cache_dir: str = CACHE_DIR) -> np.ndarray:
+    '''
+    Returns a read-only, memory-mapped copy of array, stored in the cache folder under name and a hash of its contents.
+    Processes that compute the same array map the same file, so its memory is shared between them.
+    '''
+    array = np.ascontiguousarray(array)
+    digest = hashlib.sha1(array.tobytes())
+    digest.update(f"{array.dtype.str}{array.shape}".encode())
+    path = os.path.join(cache_dir, "{}-{}.npy".format(name, digest.hexdigest()[:16]))
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        for old_path in glob.glob(os.path.join(cache_dir, name + "-*.npy")):  # Arrays of older versions of the data
+            try:
+                os.remove(old_path)  # Processes still mapping it keep their copy until they exit
+            except OSError:  # Still mapped on a platform that does not allow removing it (Windows); leave it
+                pass
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "wb") as file:
+            np.save(file, array)
+        os.replace(tmp_path, path)
+    return np.load(path, mmap_mode="r")
+
+def read_source(source: str = DEFAULT_SOURCE) -> DataFrame:
+    '''
+    Parses the source Excel file and cleans it. This is the slow path the cache exists to avoid.
+    '''
+    return _clean(pd.read_excel(source))
+
+def read_delta(path: str) -> DataFrame:
+    '''
+    Reads a file of new incidents (CSV or Parquet, with the columns of the source file) and cleans it like the source.
+    '''
+    reader = DELTA_READERS.get(os.path.splitext(path)[1].lower())
+    if reader is None:
+        raise ValueError("Unsupported file type: {}".format(path))
+    data = reader(path)
+    if "Victim.age" in data and pd.api.types.is_numeric_dtype(data["Victim.age"]):  # Ages already given as text are kept
+        data = _clean(data)
+    return data
+
+def _clean(data: DataFrame) -> DataFrame:
+    # Victim.age is shown as text ("" for unknown ages), so convert it once here instead of per row
+    age = data["Victim.age"]
+    data["Victim.age"] = age.fillna(0).astype(int).astype(str).where(age.notna(), "")
+    return data
+
+### Cache bookkeeping ###
+def _cache_paths(source: str, cache_dir: str) -> tuple[str, str]:
+    name = os.path.splitext(os.path.basename(source))[0]
+    return os.path.join(cache_dir, name + ".feather"), os.path.join(cache_dir, name + ".meta.json")
+
+def _source_stat(source: str) -> dict:
+    stat = os.stat(source)
+    return {"format": CACHE_FORMAT_VERSION, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+def _same_stat(meta: dict, source_stat: dict) -> bool:
+    return all(meta.get(key) == source_stat[key] for key in ("format", "mtime_ns", "size"))
+
+def _file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _read_meta(meta_path: str) -> dict | None:
+    try:
+        with open(meta_path) as file:
+            meta = json.load(file)
+    except (OSError, ValueError):
+        return None
+    return meta if meta.get("format") == CACHE_FORMAT_VERSION else None
+
+def _write_meta(meta_path: str, meta: dict):
+    tmp_path = meta_path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(meta, file)
+    os.replace(tmp_path, meta_path)
+
+def _read_cache(data_path: str) -> DataFrame:
+    # Memory-map the file, so only the pages that are actually used get read from disk.
+    # split_blocks keeps every column in its own block, so numeric columns point into the mapped file instead of being copied
+    return feather.read_table(data_path, memory_map=True).to_pandas(split_blocks=True)
+
+def _write_cache(data: DataFrame, data_path: str, meta_path: str, meta: dict):
+    # Write to temporary files first so a crash (or a second process) never sees a half-written cache
+    os.makedirs(os.path.dirname(data_path) or ".", exist_ok=True)
+    tmp_path = data_path + ".tmp"
+    feather.write_feather(data, tmp_path, compression="uncompressed")  # Uncompressed, otherwise it cannot be memory-mapped
+    os.replace(tmp_path, data_path)
+    _write_meta(meta_path, meta)
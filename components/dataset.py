@@ -0,0 +1,102 @@
+import threading
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+from .lru_cache import LRUCache
+
+"""
+Holds the base incident dataframe that is shared by all components.
+The data store only describes which part of this frame is selected/highlighted (see data_cleaning),
+and the components apply that description to the shared frame instead of receiving a copy of it.
+New incidents can be added while the app runs (see ingest.py): every addition creates a new Dataset with the next
+version number, which replaces the current one in a single step. A callback that takes dataset.current() once sees
+one consistent version, and store values record the version they describe, so they can still be read with get(version).
+"""
+
+RECENT_VERSIONS = 4  # Older datasets kept for store values written before the latest addition
+
+class Dataset:
+    def __init__(self, frame: DataFrame, version: int = 0):
+        # Sort by year once, so every year window is a contiguous range of rows
+        # (the loaded data is normally sorted already; then the frame, and any memory-mapped columns, are used without copying)
+        if not frame["Incident.year"].is_monotonic_increasing:
+            frame = frame.sort_values("Incident.year", kind="stable")
+        self.frame = frame.reset_index(drop=True)
+        self.version = version
+        self.years = self.frame["Incident.year"].to_numpy()
+        self.uid_index = pd.Index(self.frame["UID"])  # Hash index from UID to row position
+        # Number of incidents in every year from first_year on (0 for years without incidents)
+        self.first_year = int(self.years[0]) if len(self.years) > 0 else 0
+        self.year_counts = np.bincount(self.years - self.first_year) if len(self.years) > 0 else np.zeros(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.frame)
+
+    def year_rows(self, first_year: int, last_year: int) -> tuple[int, int]:
+        '''
+        Returns the (start, stop) row range of the incidents from first_year until last_year (inclusive).
+        '''
+        start = int(np.searchsorted(self.years, first_year, side="left"))
+        stop = int(np.searchsorted(self.years, last_year, side="right"))
+        return start, stop
+
+    def uid_mask(self, uids: list) -> np.ndarray:
+        '''
+        Returns a boolean mask over all rows that is True for the rows with the given UIDs (unknown UIDs are ignored).
+        '''
+        positions = self.uid_index.get_indexer(uids)
+        mask = np.zeros(len(self.frame), dtype=bool)
+        mask[positions[positions >= 0]] = True
+        return mask
+
+    def inserted(self, delta: DataFrame, frame: DataFrame | None = None) -> tuple["Dataset", np.ndarray]:
+        '''
+        Returns the next version of this dataset with the rows of delta added, and for every row of delta the row of
+        this dataset it was inserted before (rows of a year are added after the existing rows of that year).
+        delta must be sorted by year and have the same columns and types as the frame; this dataset is not changed.
+        frame can replace the frame of this dataset by the same rows with other column types (e.g. extended categories).
+        '''
+        frame = self.frame if frame is None else frame
+        slots = np.searchsorted(self.years, delta["Incident.year"].to_numpy(), side="right")
+        # Row order of the new frame: existing row p moves down by the number of rows inserted before it
+        source = np.empty(len(self) + len(delta), dtype=np.intp)
+        source[np.arange(len(self)) + np.searchsorted(slots, np.arange(len(self)), side="right")] = np.arange(len(self))
+        source[slots + np.arange(len(delta))] = len(self) + np.arange(len(delta))
+        frame = pd.concat([frame, delta[frame.columns]], ignore_index=True).take(source)
+
+        extended = Dataset.__new__(Dataset)  # The frame is already sorted by year; only the UID index is built again
+        extended.frame = frame.reset_index(drop=True)
+        extended.version = self.version + 1
+        extended.years = extended.frame["Incident.year"].to_numpy()
+        extended.uid_index = pd.Index(extended.frame["UID"])
+        # Year histogram: widen it if delta has years outside it, then add the counts of delta's years
+        first_year = min(self.first_year, int(extended.years[0])) if len(self) > 0 else int(extended.years[0])
+        last_year = int(extended.years[-1])
+        year_counts = np.zeros(last_year - first_year + 1, dtype=np.int64)
+        year_counts[self.first_year - first_year:self.first_year - first_year + len(self.year_counts)] = self.year_counts
+        year_counts += np.bincount(delta["Incident.year"].to_numpy() - first_year, minlength=len(year_counts))
+        extended.first_year, extended.year_counts = first_year, year_counts
+        return extended, slots
+
+_current = None
+_recent = LRUCache(RECENT_VERSIONS)  # Version -> Dataset
+_lock = threading.Lock()
+
+def set_current(data: Dataset) -> Dataset:
+    global _current
+    with _lock:
+        _recent.put(data.version, data)
+        _current = data  # Callbacks starting from now on see the new version
+    return data
+
+def current() -> Dataset:
+    return _current
+
+def get(version: int | None) -> Dataset | None:
+    '''
+    Returns the dataset with the given version (the current one if version is None), or None if it is no longer kept.
+    '''
+    data = _current
+    if version is None or (data is not None and data.version == version):
+        return data
+    return _recent.get(version)
@@ -0,0 +1,105 @@
+import copy
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+from .schema import OTHER_LABEL, category_codes
+
+"""
+Groups low-frequency values into "~Other" for several features at once.
+Every groupable column is encoded once as integer category codes. On each store update the value counts of all features
+among the selected points are then computed with a single bincount, and low-frequency values are replaced through a
+per-feature lookup table from codes to labels, instead of casting and comparing strings row by row.
+Categorical features (see schema.py) use their category codes, and their grouped columns stay categorical.
+When incidents are added (see ingest.py), only the codes of the new rows are computed and inserted, as long as all their
+values are known already.
+"""
+
+class LowFreqGrouping:
+    def __init__(self, frame: DataFrame, features: list[str], threshold: float = 0.01):
+        self.features = features
+        self.threshold = threshold  # Values making up less than this fraction of the selected points are grouped
+        self.labels = {}      # Feature -> text label per code; code k is "~Other" and code k+1 is missing (NaN)
+        self.groupable = {}   # Feature -> whether values can actually be replaced by "~Other" (see below)
+        self.dtypes = {}      # Feature -> categorical type of the feature (only for categorical features)
+        self.offsets = []     # Start of each feature's codes in the combined code space
+        codes = []
+        offset = 0
+        for feature in features:
+            feature_codes, values = category_codes(frame[feature])
+            n_values = len(values)
+            feature_codes = np.where(feature_codes == -1, n_values + 1, feature_codes.astype(np.int32))  # Missing values get their own code
+            if isinstance(frame[feature].dtype, pd.CategoricalDtype):
+                self.dtypes[feature] = frame[feature].dtype  # Its categories are the values followed by "~Other"
+            codes.append((feature_codes + offset).astype(np.int32))
+            self.labels[feature] = np.array(list(values.astype("string")) + [OTHER_LABEL, np.nan], dtype=object)
+            # The original grouping compared the *text* of each value with the low-frequency values, which never
+            # matches for numeric columns (e.g. Incident.year); those are only converted to text, which keeps years readable.
+            self.groupable[feature] = not pd.api.types.is_numeric_dtype(frame[feature])
+            self.offsets.append(offset)
+            offset += n_values + 2
+        self.codes = np.stack(codes, axis=1) if codes else np.empty((len(frame), 0), dtype=np.int32)  # One row per incident, one column per feature
+        self.n_codes = offset
+
+    def inserted(self, slots: np.ndarray, delta: DataFrame) -> "LowFreqGrouping | None":
+        '''
+        Returns the grouping of the data with the rows of delta inserted before the given rows (see Dataset.inserted),
+        computing only the codes of the new rows. Returns None if delta has a value that has no code yet (or the
+        categories of a categorical feature have changed), in which case the grouping has to be built again.
+        '''
+        codes = []
+        for feature, offset in zip(self.features, self.offsets):
+            n_values = len(self.labels[feature]) - 2
+            if feature in self.dtypes:
+                if delta[feature].dtype != self.dtypes[feature]:
+                    return None
+                feature_codes = delta[feature].cat.codes.to_numpy().astype(np.int32)
+            else:
+                # Codes are the positions of the values in sorted order, as in category_codes
+                known = pd.Index(self.labels[feature][:n_values]).get_indexer(delta[feature].astype("string"))
+                if ((known == -1) & delta[feature].notna().to_numpy()).any():
+                    return None
+                feature_codes = known.astype(np.int32)
+            codes.append(np.where(feature_codes == -1, n_values + 1, feature_codes) + offset)
+        grouping = copy.copy(self)  # Labels and types are shared; only the codes change
+        if codes:
+            grouping.codes = np.insert(self.codes, slots, np.stack(codes, axis=1).astype(np.int32), axis=0)
+        return grouping
+
+    def low_freq_codes(self, rows: tuple[int, int], selected: np.ndarray | None = None) -> dict:
+        '''
+        Returns, per feature, the codes of the values that make up less than 1% of the selected points in the given row range.
+        selected is a boolean mask over the rows (None means all rows are selected).
+        '''
+        codes = self.codes[rows[0]:rows[1]]
+        if selected is not None:
+            codes = codes[selected]
+        counts = np.bincount(codes.ravel(), minlength=self.n_codes)  # Counts of every value of every feature in one pass
+        min_count = len(codes) * self.threshold
+        low_freq = {}
+        for feature, offset in zip(self.features, self.offsets):
+            n_values = len(self.labels[feature]) - 2
+            feature_counts = counts[offset:offset + n_values]
+            low_freq[feature] = np.flatnonzero((feature_counts > 0) & (feature_counts < min_count)).tolist()
+        return low_freq
+
+    def grouped_columns(self, rows: tuple[int, int], low_freq: dict) -> dict:
+        '''
+        Returns the grouped columns (as text or categoricals, with low-frequency values replaced by "~Other") for the given row range,
+        for every feature that has low-frequency values. Features without low-frequency values are left as they are.
+        '''
+        columns = {}
+        for index, (feature, offset) in enumerate(zip(self.features, self.offsets)):
+            low_codes = low_freq.get(feature, [])
+            if len(low_codes) == 0:
+                continue
+            labels = self.labels[feature]
+            lookup = np.arange(len(labels))
+            if self.groupable[feature]:
+                lookup[low_codes] = len(labels) - 2  # Remap low-frequency codes to "~Other"
+            feature_codes = self.codes[rows[0]:rows[1], index] - offset
+            if feature in self.dtypes:
+                lookup[-1] = -1  # Missing
+                columns[feature] = pd.Categorical.from_codes(lookup[feature_codes], dtype=self.dtypes[feature])
+            else:
+                columns[feature] = labels[lookup[feature_codes]]
+        return columns
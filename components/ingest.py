@@ -0,0 +1,160 @@
+import logging
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+from dash import Dash, Input, Output, State, dcc, html
+from dash.exceptions import PreventUpdate
+from pandas import DataFrame
+from . import data_cleaning, data_loader, dataset, timeline_component
+from .dataset import Dataset
+
+"""
+Adds new incidents to the running app, without a restart or parsing the source file again.
+New incidents are dropped as CSV or Parquet files (with the columns of sharks_clean.xlsx) into a drop directory, which
+is checked every POLL_INTERVAL seconds. Files are added in name order and never changed afterwards (write a file under
+another name and rename it when it is complete); a file that does not match the schema of the data is skipped.
+Every file is validated and converted to the column types of the base data, and the base data and the structures
+derived from it (category codes, year counts, grouping codes, spatial index, count cubes) are extended with its rows
+(see data_cleaning.extend_dataset) into a new version of the dataset, which then replaces the current one at once.
+Every server process watches the directory itself; the files stay in it, so a restart adds them again.
+Added and skipped files are reported through the "components.ingest" logger, and stats() counts them (served at
+/metrics with ENABLE_METRICS=1, see app.py); skipped holds the reason every skipped file was not added.
+In the browser, render() checks for a new version at the same interval and then updates the year slider and the
+timeline, which makes the data store (and so every plot) update with the new incidents.
+"""
+
+POLL_INTERVAL = 10  # Seconds
+
+_lock = threading.Lock()  # One file is added at a time
+_seen = {}  # File name -> (modification time, size) of the files already added or skipped
+added = []  # Names of the files added, in order
+skipped = {}  # File name -> reason it was not added
+logger = logging.getLogger(__name__)
+
+def validate(delta: DataFrame, base: Dataset) -> DataFrame:
+    '''
+    Returns the new incidents in delta with the columns and column types of the base data (categorical columns as text).
+    Raises ValueError if delta does not fit: missing or unknown columns, values of the wrong type, missing years,
+    coordinates out of range, or UIDs that are not unique or already in use.
+    '''
+    frame = base.frame
+    missing = [column for column in frame.columns if column not in delta]
+    unknown = [column for column in delta.columns if column not in frame]
+    if missing or unknown:
+        raise ValueError("Columns do not match the data (missing: {}, unknown: {})".format(missing, unknown))
+    if len(delta) == 0:
+        raise ValueError("No incidents")
+
+    columns = {}
+    for column, dtype in frame.dtypes.items():
+        values = delta[column]
+        if isinstance(dtype, pd.CategoricalDtype):
+            columns[column] = values.astype(dtype.categories.dtype)  # Converted to the categories by extend_dataset
+        elif pd.api.types.is_numeric_dtype(dtype):
+            numbers = pd.to_numeric(values, errors="coerce")
+            if (numbers.isna() & values.notna()).any():
+                raise ValueError("{} has values that are not numbers".format(column))
+            if dtype.kind in "iu" and (numbers.isna().any() or (numbers != np.round(numbers)).any()):
+                raise ValueError("{} has missing or non-integer values".format(column))
+            columns[column] = numbers.astype(dtype)
+        else:
+            columns[column] = values.astype(dtype)
+    delta = DataFrame(columns)
+
+    if not delta["UID"].is_unique or base.uid_index.isin(delta["UID"]).any():
+        raise ValueError("UIDs are not unique or already in use")
+    if not delta["Latitude"].between(-90, 90).all() or not delta["Longitude"].between(-180, 180).all():
+        raise ValueError("Coordinates are missing or out of range")
+    return delta
+
+def ingest_file(path: str) -> Dataset:
+    '''
+    Adds the incidents in the file at path to the current dataset and returns the new version.
+    Raises ValueError (and leaves the current dataset as it is) if the file does not fit the data.
+    '''
+    with _lock:
+        base = dataset.current()
+        delta = validate(data_loader.read_delta(path), base)
+        return dataset.set_current(data_cleaning.extend_dataset(base, delta))
+
+def poll(directory: str) -> list[str]:
+    '''
+    Adds the files in directory that have not been seen before, in name order, and returns the names of those added.
+    '''
+    if not os.path.isdir(directory):
+        return []
+    added_now = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.splitext(name)[1].lower() not in data_loader.DELTA_READERS or not os.path.isfile(path):
+            continue
+        stat = os.stat(path)
+        if _seen.get(name) == (stat.st_mtime_ns, stat.st_size):
+            continue
+        _seen[name] = (stat.st_mtime_ns, stat.st_size)
+        try:
+            base = ingest_file(path)
+        except Exception as error:  # Any unreadable or invalid file is skipped; the watcher has to keep running
+            skipped[name] = str(error)
+            logger.warning("Skipped %s: %s", path, error)
+            continue
+        skipped.pop(name, None)
+        added.append(name)
+        added_now.append(name)
+        logger.info("Added %s (dataset version %d, %d incidents)", path, base.version, len(base))
+    return added_now
+
+def stats() -> dict:
+    base = dataset.current()
+    return {"files_added": len(added), "files_skipped": len(skipped), "dataset_version": getattr(base, "version", 0),
+            "incidents": len(base) if base is not None else 0}
+
+def start(directory: str, interval: float = POLL_INTERVAL) -> threading.Thread:
+    '''
+    Adds the files already in directory, then keeps watching it for new files in a background thread.
+    '''
+    poll(directory)
+    def watch():
+        while True:
+            time.sleep(interval)
+            poll(directory)
+    thread = threading.Thread(target=watch, name="ingest", daemon=True)
+    thread.start()
+    return thread
+
+def render(app: Dash, id: str, interval: float = POLL_INTERVAL) -> html.Div:
+    '''
+    Keeps the year slider and the timeline of every open page up to date with the current version of the dataset.
+    Must be created after the data store and the timeline.
+    '''
+    @app.callback(
+        Output(id, "data"),
+        Output("slider", "min"),
+        Output("slider", "max"),
+        Output("slider", "marks"),
+        Output("slider", "value"),
+        Output("timeline_counts", "data"),
+        Output("timehist", "figure", allow_duplicate=True),
+        Input(id + "_interval", "n_intervals"),
+        State(id, "data"),
+        State("slider", "value"),
+        State("slider", "min"),
+        State("slider", "max"),
+        prevent_initial_call="initial_duplicate"  # Also checks on page load, as the layout was made with the first version
+    )
+    def refresh(_, version, input_year, min_year, max_year):
+        base = dataset.current()
+        if base.version == version:
+            raise PreventUpdate
+        first_year, last_year = base.first_year, base.first_year + len(base.year_counts) - 1
+        # A range that reached the first or last year grows with the data; other ranges stay as they are.
+        # Setting the value makes the data store, and so every plot, update with the new version.
+        input_year = [first_year if input_year[0] <= min_year else input_year[0], last_year if input_year[1] >= max_year else input_year[1]]
+        return (base.version, first_year, last_year, timeline_component.slider_marks(first_year, last_year), input_year,
+                timeline_component.counts_data(base.first_year, base.year_counts),
+                timeline_component.make_figure(base.first_year, base.year_counts, input_year))
+
+    return html.Div(children=[dcc.Store(id=id, data=dataset.current().version),
+                              dcc.Interval(id=id + "_interval", interval=interval * 1000)])
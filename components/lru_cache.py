@@ -0,0 +1,96 @@
+import threading
+from collections import OrderedDict
+
+"""
+A small bounded cache shared by the components.
+Entries are evicted least-recently-used first once the cache is full.
+All operations take a lock, so the cache can be used from concurrently running callbacks.
+"""
+
+_MISSING = object()
+
+class LRUCache:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._computing = {}  # Key -> lock held while get_or_compute computes the value for that key
+
+    def get(self, key, default=None):
+        '''
+        Returns the value stored under key (marking it as recently used), or default if it is not cached.
+        '''
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return default
+
+    def get_or_compute(self, key, compute):
+        '''
+        Returns the value stored under key, or computes it with compute(), stores it and returns it.
+        Concurrent calls for the same key compute the value only once: the others wait for it and reuse it.
+        '''
+        with self._lock:
+            value = self._lookup(key)
+            if value is not _MISSING:
+                return value
+            key_lock = self._computing.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                with self._lock:
+                    value = self._lookup(key)  # Computed by another thread while this one was waiting
+                    if value is _MISSING:
+                        self.misses += 1
+                if value is _MISSING:
+                    value = compute()
+                    self.put(key, value)
+        finally:  # Also if compute() raises (e.g. PreventUpdate), so no lock is left behind for the key
+            with self._lock:
+                self._computing.pop(key, None)
+        return value
+
+    def _lookup(self, key):
+        # Returns the value (counted as a hit) or _MISSING; the caller holds the lock
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+        return _MISSING
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def items(self) -> list:
+        '''
+        Returns the (key, value) pairs, least recently used first, without counting them as uses.
+        '''
+        with self._lock:
+            return list(self._entries.items())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._entries), "maxsize": self.maxsize,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
@@ -0,0 +1,131 @@
+import bisect
+import threading
+import time
+import flask
+from dash import Dash
+from dash.exceptions import PreventUpdate
+
+"""
+Records how long every callback takes and how much data goes in and out, and serves the numbers at /metrics
+in the Prometheus text format.
+Nothing is recorded unless instrument(app) is called (see ENABLE_METRICS in app.py), so the callbacks run
+exactly as before when metrics are switched off.
+Every server process keeps its own numbers; with several workers each worker reports its own share.
+"""
+
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]  # Seconds
+SIZE_BUCKETS = [256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216]  # Bytes
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: list):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series = {}  # Labels -> [count per bucket (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1  # Buckets are upper bounds (le), inclusive
+            series[1] += value
+
+    def expose(self, label_names: tuple) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+        for labels, (counts, total) in sorted(series.items()):
+            label_text = _format_labels(label_names, labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ["+Inf"], counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+            lines.append(f"{self.name}_count{{{label_text}}} {cumulative}")
+        return lines
+
+class CallbackMetrics:
+    LABELS = ("callback", "output")
+
+    def __init__(self):
+        self.duration = Histogram("dash_callback_duration_seconds", "Wall time of a callback invocation.", DURATION_BUCKETS)
+        self.input_bytes = Histogram("dash_callback_input_bytes", "Size of the request body (inputs and states) of a callback.", SIZE_BUCKETS)
+        self.output_bytes = Histogram("dash_callback_output_bytes", "Size of the JSON response of a callback.", SIZE_BUCKETS)
+        self._calls = {}  # (callback, output, status) -> number of invocations
+        self._lock = threading.Lock()
+
+    def record(self, labels: tuple, status: str, duration: float, input_bytes: int, output_bytes: int | None):
+        self.duration.observe(labels, duration)
+        self.input_bytes.observe(labels, input_bytes)
+        if output_bytes is not None:
+            self.output_bytes.observe(labels, output_bytes)
+        with self._lock:
+            self._calls[labels + (status,)] = self._calls.get(labels + (status,), 0) + 1
+
+    def expose(self) -> str:
+        lines = ["# HELP dash_callback_calls_total Number of callback invocations, by outcome (ok, prevented or error).",
+                 "# TYPE dash_callback_calls_total counter"]
+        with self._lock:
+            calls = dict(self._calls)
+        for labels, count in sorted(calls.items()):
+            lines.append(f"dash_callback_calls_total{{{_format_labels(self.LABELS + ('status',), labels)}}} {count}")
+        for histogram in (self.duration, self.input_bytes, self.output_bytes):
+            lines += histogram.expose(self.LABELS)
+        return "\n".join(lines) + "\n"
+
+def instrument(app: Dash, path: str = "/metrics", stats: dict | None = None) -> CallbackMetrics:
+    '''
+    Wraps every callback registered on app so its wall time, request/response size and outcome are recorded,
+    and adds a route at path that returns the recorded metrics in the Prometheus text format.
+    stats maps a name to a function returning a dict of numbers (e.g. SessionState.stats), which are served as
+    gauges named <name>_<key>.
+    Call this after all callbacks have been registered.
+    '''
+    metrics = CallbackMetrics()
+    for output, entry in app.callback_map.items():
+        if "callback" not in entry:  # Clientside callbacks run in the browser and have no server-side function
+            continue
+        entry["callback"] = _instrumented(entry["callback"], output, metrics)
+
+    @app.server.route(path)
+    def serve_metrics():
+        return flask.Response(metrics.expose() + _expose_stats(stats or {}), mimetype="text/plain; version=0.0.4")
+
+    return metrics
+
+def _instrumented(callback, output: str, metrics: CallbackMetrics):
+    # Dash keeps the user's function as __wrapped__, so its name identifies the callback (e.g. filter_dataframe)
+    labels = (getattr(getattr(callback, "__wrapped__", callback), "__name__", "callback"), output)
+
+    def instrumented(*args, **kwargs):
+        input_bytes = (flask.request.content_length or 0) if flask.has_request_context() else 0
+        start = time.perf_counter()
+        try:
+            response = callback(*args, **kwargs)
+        except PreventUpdate:
+            metrics.record(labels, "prevented", time.perf_counter() - start, input_bytes, None)
+            raise
+        except Exception:
+            metrics.record(labels, "error", time.perf_counter() - start, input_bytes, None)
+            raise
+        output_bytes = len(response) if isinstance(response, (str, bytes)) else None
+        metrics.record(labels, "ok", time.perf_counter() - start, input_bytes, output_bytes)
+        return response
+
+    instrumented.__wrapped__ = getattr(callback, "__wrapped__", callback)  # Keep the user's function reachable, like Dash does
+    return instrumented
+
+def _expose_stats(stats: dict) -> str:
+    lines = []
+    for name, get_stats in stats.items():
+        for key, value in get_stats().items():
+            lines += [f"# TYPE {name}_{key} gauge", f"{name}_{key} {value}"]
+    return "".join(line + "\n" for line in lines)
+
+def _format_labels(names: tuple, values: tuple) -> str:
+    return ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values))
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
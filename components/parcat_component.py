@@ -1,9 +1,11 @@
 from dash import Dash, html, dcc, Input, Output
 import plotly.express as px
+import numpy as np
 import pandas as pd
 from pandas import DataFrame
-from .data_cleaning import MONTH_ORDER, GRAYED_OUT_COLOR
-from .data_cleaning import MONTH_ORDER, GRAYED_OUT_COLOR
+from .data_cleaning import GRAYED_OUT_COLOR, encode_codes, read_store
+from .schema import observed_values
+from . import background
 
 """
 Creates a new parallel categories component instance.
@@ -18,26 +20,32 @@ String id - A unique ID not used by any other component in our app
 PLOTLY_DEFAULT_COLORS = ['#636EFA','#EF553B','#00CC96','#AB63FA','#FFA15A','#19D3F3','#FF6692',
                         '#B6E880','#FF97FF','#FECB52']
 
+# Draw one weighted path per distinct combination of dimension values and color, instead of one path per incident,
+# so the figure grows with the number of distinct paths rather than the number of incidents.
+# Clicks then report path indices; the plot stores which path every selected incident belongs to in "parcat_paths",
+# from which the data store finds the incidents to highlight. Set to False to draw one path per incident as before.
+AGGREGATE_PATHS = True
+
 app = Dash(__name__)
 
 def render(app: Dash, id: str, data: DataFrame)-> dcc.Graph:
     @app.callback(
         Output("parcat", "figure"),
+        Output("parcat_paths", "data"),
         [Input("data_store", "data"),
          Input("parcat_dropdown", "value"),
          Input("primary_color_dropdown", "value"),
-         Input("secondary_color_dropdown", "value")]
+         Input("secondary_color_dropdown", "value")],
+        **background.callback_options(id)
     )
     def update_figure(selected_data, selected_features, primary_color_feature, secondary_color_feature):
         # Read data from data storage
-        if selected_data is None:
-            selected_data = data
-        selected_data = DataFrame(selected_data)
+        selected_data = read_store(selected_data, data)
         filtered_data = selected_data.loc[selected_data['selected'] == 1]  # Only consider selected points
 
         # Return empty plot if no features are selected
         if selected_features is None or len(selected_features) == 0:
-            return px.parallel_categories(dimensions=[])
+            return px.parallel_categories(dimensions=[]), None
 
         # Find highest-priority color feature
         if not(secondary_color_feature is None or secondary_color_feature == []):
@@ -47,9 +55,9 @@ def render(app: Dash, id: str, data: DataFrame)-> dcc.Graph:
 
         # Make PCP with color according to selected dropdown values
         # If anything is brushed, apply brushing colors - this is highest priority.
-        if any([color != GRAYED_OUT_COLOR for color in filtered_data['highlighted']]):
+        if (filtered_data['highlighted'] != GRAYED_OUT_COLOR).any():
             #filtered_data = filtered_data.sort_values('highlighted')  # Sort data by highlight
-            fig = px.parallel_categories(filtered_data, dimensions=selected_features, color='highlighted')
+            colors = filtered_data['highlighted']
 
         # If nothing is brushed, but a primary and/or secondary color feature is selected, color according to that feature
         elif not(color_feature is None or color_feature == []):
@@ -57,23 +65,25 @@ def render(app: Dash, id: str, data: DataFrame)-> dcc.Graph:
             #fig = px.parallel_categories(filtered_data, dimensions=selected_features, color=color_feature)
             #fig = px.parallel_categories(filtered_data, dimensions=selected_features, color=color_feature)
             # However, for some godforsaken reason it won't work, so that's why we do this mess instead:
-            barplot_x_values = filtered_data[color_feature].value_counts().index.tolist()  # Get unique values for barplot x attribute
-            # Sort months according to special ordering, otherwise sort alphabetically
-            if(color_feature == 'Incident.month'):
-                barplot_x_values = sorted(barplot_x_values, key=lambda x: MONTH_ORDER[x])
-            else:
-                barplot_x_values = sorted(barplot_x_values)
-            colors = filtered_data[color_feature].apply(lambda x: PLOTLY_DEFAULT_COLORS[barplot_x_values.index(x) % len(PLOTLY_DEFAULT_COLORS)])  # Color according to attribute value
-            fig = px.parallel_categories(filtered_data, dimensions=selected_features, color=colors)
+            barplot_x_values = observed_values(filtered_data[color_feature])  # Unique values for barplot x attribute, in canonical order (see schema.py)
+            value_colors = {x: PLOTLY_DEFAULT_COLORS[index % len(PLOTLY_DEFAULT_COLORS)] for index, x in enumerate(barplot_x_values)}
+            # Color according to attribute value, looked up once per distinct value and then by integer code
+            codes, values = pd.factorize(filtered_data[color_feature])
+            code_colors = np.array([value_colors[value] for value in values] + [GRAYED_OUT_COLOR], dtype=object)  # Missing values (code -1) are grey
+            colors = pd.Series(code_colors[codes], index=filtered_data.index, name=color_feature)
             
         # Otherwise, don't apply color at all
         else:
-            colors = [GRAYED_OUT_COLOR]*len(filtered_data)
-            fig = px.parallel_categories(filtered_data, dimensions=selected_features, color=colors)
+            colors = pd.Series(GRAYED_OUT_COLOR, index=filtered_data.index, name='color')
+
+        if AGGREGATE_PATHS:
+            fig, parcat_paths = _aggregated_figure(filtered_data, selected_features, colors)
+        else:
+            fig, parcat_paths = px.parallel_categories(filtered_data, dimensions=selected_features, color=colors), None
 
         # Sort categories according to order in data_cleaning
         fig.update_traces(dimensions=[{'categoryorder': 'array', 
-                                       'categoryarray': sorted(filtered_data[feature].drop_duplicates(), key=((lambda x: MONTH_ORDER[x]) if feature == 'Incident.month' else None)),
+                                       'categoryarray': observed_values(filtered_data[feature]),
                                        'label': feature.replace(".", " ")} 
                                        for feature in selected_features])
         
@@ -83,6 +93,23 @@ def render(app: Dash, id: str, data: DataFrame)-> dcc.Graph:
             margin=dict(l=20,r=20,t=20,b=20)
         )  # Stack bars on top of each other
 
-        return fig
+        return fig, parcat_paths
     
-    return html.Div(children= [html.H5('Shark Incidents Related by Selected Attributes', style={'textAlign': 'center'}), dcc.Graph(id = id)],style={'backgroundColor': '#2C353C','margin-top': '10px', 'padding': '10px',})
\ No newline at end of file
+    return html.Div(children= [html.H5('Shark Incidents Related by Selected Attributes', style={'textAlign': 'center'}), dcc.Graph(id = id), dcc.Store(id="parcat_paths")],style={'backgroundColor': '#2C353C','margin-top': '10px', 'padding': '10px',})
+def _aggregated_figure(filtered_data: DataFrame, dimensions: list[str], colors: pd.Series):
+    '''
+    Draws one path per distinct combination of dimension values and color, weighted by the number of incidents on it.
+    Returns the figure and the path of every incident (in row order), packed for the "parcat_paths" store.
+    '''
+    # Integer codes per dimension (and color), so the distinct paths are found with one np.unique over a small matrix
+    codes = np.stack([pd.factorize(filtered_data[feature])[0] for feature in dimensions] + [pd.factorize(colors)[0]], axis=1)
+    _, first, path_codes = np.unique(codes, axis=0, return_index=True, return_inverse=True)
+    order = np.argsort(first)  # Paths in order of their first incident, like the per-incident plot draws them
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    path_codes = rank[path_codes.ravel()]
+    first = first[order]
+
+    fig = px.parallel_categories(filtered_data.iloc[first], dimensions=dimensions, color=colors.iloc[first])
+    fig.update_traces(counts=np.bincount(path_codes, minlength=len(first)))
+    return fig, {"paths": len(first), "points": len(path_codes), "codes": encode_codes(path_codes, len(first))}
@@ -1,8 +1,17 @@
+import functools
+import hashlib
+import json
+import numpy as np
+import pandas as pd
 import plotly.express as px
-from dash import Dash, dcc, ctx
+import plotly.graph_objects as go
+from dash import Dash, html, dcc, ctx, Patch, no_update
+from dash.exceptions import PreventUpdate
 from pandas import DataFrame
 from dash.dependencies import Input, Output, State
-from .data_cleaning import MONTH_ORDER, GRAYED_OUT_COLOR, UNSELECTED_OPACITY
+from .data_cleaning import GRAYED_OUT_COLOR, GROUPABLE_FEATURES, read_store
+from .spatial import GridClusters, in_bounds
+from . import background, dataset
 
 #Predefined colors for specific attributes
 PREDEFINED_COLORS = {"Provoked/unprovoked": ["#00c49d","#c42e00","#dbdbdb"],
@@ -12,6 +21,18 @@ PLOTLY_DEFAULT_COLORS = ['#636EFA','#EF553B','#00CC96','#AB63FA','#FFA15A','#19D
                         '#B6E880','#FF97FF','#FECB52']
 GLOBAL_CUSTOM_DATA = ["UID", "selected", "Incident.month", "Incident.year", "Victim.injury", "State", "Site.category", "Provoked/unprovoked",
                       "Victim.activity", "Injury.severity", "Victim.gender", "Data.source", "Shark.name", "Victim.age"]
+# Custom data columns that can differ from the loaded data between store updates; all other columns are taken from
+# the custom data array that is built once when the map is created
+DYNAMIC_CUSTOM_DATA = ["selected"] + [feature for feature in GLOBAL_CUSTOM_DATA if feature in GROUPABLE_FEATURES]
+# If the traces on the map stay the same (same color feature and the same groups of that feature), only send the trace
+# properties that changed (points, opacity, colors, custom data) as a partial update instead of rebuilding the whole figure
+INCREMENTAL_UPDATES = True
+# Level of detail for large datasets: with at least LOD_MIN_POINTS incidents, the map only draws the incidents inside the
+# visible part of the map (taken from its relayoutData), and if that is still more than MAX_POINTS it draws one
+# cluster marker per grid cell instead (see spatial.py), so the figure size stays bounded however large the data is
+LOD_MIN_POINTS = 20000
+MAX_POINTS = 5000
+DEFAULT_ZOOM = 3
 """
 Creates a new scatter map instance component.
 Dash app - The application (used for callbacks)
@@ -33,19 +54,56 @@ String id - A unique ID not used by any other component in our app
 # Instead, use for_each_trace with a different update depending on the trace's name. For example, to reduce the opacity of unselected points:
 # fig.for_each_trace(lambda trace: trace.update(marker_opacity = data.loc[data[color_feature] == trace.name, 'selected']))
 
-def render(app: Dash, all_data: DataFrame, id: str) -> dcc.Graph:
+def render(app: Dash, all_data: DataFrame, id: str) -> html.Div:
+    # Arrays built once per version of the data (again when incidents have been added, see ingest.py)
+    latest = [None]  # (version, arrays), replaced as a whole
+    def map_arrays() -> dict:
+        base = dataset.current()
+        version = None if base is None else base.version
+        if latest[0] is None or latest[0][0] != version:
+            frame = all_data if base is None else base.frame
+            lod = len(frame) >= LOD_MIN_POINTS
+            latest[0] = (version, {
+                # Custom data of every incident, in the order of GLOBAL_CUSTOM_DATA, looked up by UID on each update
+                "customdata": frame.assign(selected=1)[GLOBAL_CUSTOM_DATA].to_numpy(dtype=object),
+                "uid_positions": pd.Index(frame["UID"]),
+                "lod": lod,
+                "clusters": GridClusters(frame["Latitude"].to_numpy(), frame["Longitude"].to_numpy()) if lod else None,
+            })
+        return latest[0][1]
+
     @app.callback(
         Output("map", "figure"),
+        Output("map_state", "data"),
         Input("data_store", "data"),
         Input("primary_color_dropdown", "value"),
         Input("secondary_color_dropdown", "value"),
-        prevent_initial_call=True
+        Input("map", "relayoutData"),
+        State("map_state", "data"),
+        prevent_initial_call=True,
+        **background.callback_options(id)
     )
-    def change_display(data, primary_color_feature, secondary_color_feature):
+    def change_display(data, primary_color_feature, secondary_color_feature, relayout_data, map_state):
+        arrays = map_arrays()
+        base_customdata, uid_positions, lod, clusters = arrays["customdata"], arrays["uid_positions"], arrays["lod"], arrays["clusters"]
+        # Panning and zooming only changes what is drawn in the level-of-detail view; other relayout events
+        # (e.g. {"dragmode": "lasso"} from the modebar or {"autosize": true}) do not change the view at all
+        if ctx.triggered_id == "map" and (not lod or not _has_view(relayout_data)):
+            raise PreventUpdate
+        # relayoutData only holds the keys of the latest relayout event, so the last known view is kept in map_state
+        view = _map_view(relayout_data, (map_state or {}).get("view"))
+
         # Read data
-        if data is None:
-            data = all_data
-        data = DataFrame(data)  # Convert stored JSON to dataframe
+        data = read_store(data, all_data)
+
+        # Large datasets: keep only the incidents in view, or draw clusters if there are still too many of them
+        if lod:
+            zoom, bounds = view["zoom"], view["bounds"]
+            positions = uid_positions.get_indexer(data["UID"])
+            visible = in_bounds(clusters.latitude[positions], clusters.longitude[positions], bounds)
+            if np.count_nonzero(visible) > MAX_POINTS:
+                return _cluster_figure(data[visible], positions[visible], zoom, clusters), {"layout": "clusters", "view": view}
+            data = data[visible]
 
         # Find highest-priority color feature
         if not(secondary_color_feature is None or secondary_color_feature == []):
@@ -53,51 +111,199 @@ def render(app: Dash, all_data: DataFrame, id: str) -> dcc.Graph:
         else:
             color_feature = primary_color_feature
 
+        # Decide how the points are divided over traces (see the warning above): one trace for all points,
+        # or one trace per value of the color feature (data is sorted by that feature, so each trace is a block of rows)
         # If a bar is clicked in the barplot or PCP, change color based on the highlighted bar
-        if any([color != GRAYED_OUT_COLOR for color in data['highlighted']]):
-            data = data.sort_values('highlighted', ascending=False)  # Sort so highlighted points are drawn on top
-            fig = px.scatter_map(data, lat="Latitude", lon="Longitude", hover_name="Shark.name",
-                                 zoom=3,
-                                 custom_data=GLOBAL_CUSTOM_DATA)
-            fig.update_traces(marker_color=data['highlighted'])
-            fig.update_traces(marker_opacity=data['selected'])  # Reduce opacity of unselected points
-            fig.update_traces(hoverinfo="text", 
-                              hovertemplate=[None if hoverable == 0 else _get_hover_template(color_feature) for hoverable in data['selected']]) # Set Hoverable template for all points. Points that are NOT selected (aka not visible) have no hover info.
+        highlighted = data['highlighted'].to_numpy() != GRAYED_OUT_COLOR
+        if highlighted.any():
+            mode = "highlight"
+            # The rows keep their order, so another highlight only changes the colors (and the points of the overlay below)
+            trace_rows = [np.arange(len(data))]
 
         # Otherwise, change color based on primary color attribute if one is selected
         elif not(color_feature is None or color_feature == []):
-            # Sort months according to special ordering, otherwise sort alphabetically
-            if(color_feature == 'Incident.month'):
-                data = data.sort_values(color_feature, key=lambda x: x.map(MONTH_ORDER))
-            else:
-                data = data.sort_values(color_feature)
+            mode = "color"
+            # Categorical columns sort in their canonical order (months in calendar order, see schema.py), others alphabetically
+            data = data.sort_values(color_feature, kind="stable")
+            values = data[color_feature].to_numpy()
+            trace_rows = np.split(np.arange(len(data)), np.flatnonzero(values[1:] != values[:-1]) + 1) if len(data) else []
+
+        # If no primary color attribute is selected, grey out all points
+        else:
+            mode = "grey"
+            trace_rows = [np.arange(len(data))]
+
+        # Points that are not selected (aka not visible) have no hover info: per trace, they are split off into a trace
+        # that cannot be hovered, drawn below the selected points. Both parts are always drawn (also when empty), so the
+        # traces only change with the groups, and a new selection or year window only changes the points in them.
+        # Highlighted points are drawn on top, in an overlay trace of their own that is always there in highlight mode.
+        parts = _hover_parts(trace_rows, data['selected'].to_numpy() == 1, highlighted if mode == "highlight" else None)
+        customdata = _customdata(data, base_customdata, uid_positions)
+        properties = [_trace_properties(data.iloc[rows], customdata[rows], mode) for _, rows, _ in parts]
+        # One hover template for every point on the map, so it is set once per trace instead of once per point
+        hovertemplate = _get_hover_template(color_feature if isinstance(color_feature, str) else None)
+        # The hover template only depends on the mode and color feature, so it is part of the layout fingerprint
+        groups = data[color_feature].to_numpy()[[rows[0] for rows in trace_rows]] if mode == "color" else []
+        new_state = {"layout": _fingerprint([mode, color_feature, list(groups)]),
+                     "properties": [{name: _fingerprint(value) for name, value in trace.items()} for trace in properties],
+                     "view": view}
+
+        # Same traces as the figure currently shown: only send the properties that changed
+        if INCREMENTAL_UPDATES and map_state is not None and map_state["layout"] == new_state["layout"]:
+            return _patch_figure(properties, new_state["properties"], map_state["properties"]), new_state
+
+        if mode == "highlight":
+            fig = px.scatter_map(data, lat="Latitude", lon="Longitude", hover_name="Shark.name",
+                                 zoom=3)
+        elif mode == "color":
             # Make figure
             fig = px.scatter_map(data, lat="Latitude", lon="Longitude", hover_name="Shark.name",
                         zoom=3,
-                        custom_data=GLOBAL_CUSTOM_DATA,
                         color=color_feature, labels={color_feature: color_feature.replace(".", " ")})
-            fig.for_each_trace(lambda trace: trace.update(marker_opacity = data.loc[data[color_feature] == trace.name, 'selected']))  # Reduce opacity of unselected points
-            fig.for_each_trace(lambda trace: trace.update(hoverinfo="text", 
-                                                          hovertemplate=[None if hoverable == UNSELECTED_OPACITY else _get_hover_template(color_feature) for hoverable in data.loc[data[color_feature] == trace.name, 'selected']])) # Set Hoverable template for all points. Points that are NOT selected (aka not visible) have no hover info.
-
-        # If no primary color attribute is selected, grey out all points
         else:
             colorSeq = [GRAYED_OUT_COLOR]
             fig = px.scatter_map(data, lat="Latitude", lon="Longitude", hover_name="Shark.name",
                                  zoom=3,
-                                 custom_data=GLOBAL_CUSTOM_DATA,
                                  color=None, color_discrete_sequence=colorSeq)
-            fig.update_traces(marker_opacity=data['selected'])  # Reduce opacity of unselected points
-            fig.update_traces(hoverinfo="text", hovertemplate=[None if hoverable == 0 else _get_hover_template(color_feature) for hoverable in data['selected']]) # Set Hoverable template for all points. Points that are NOT selected (aka not visible) have no hover info.
+        # Set custom data, highlight colors and hover templates and reduce opacity of unselected points, per trace
+        # (the traces made by plotly express, one per block of trace_rows, are copied for every part of them, see _hover_parts)
+        traces = []
+        for (block, rows, hoverable), trace_properties in zip(parts, properties):
+            trace = go.Scattermap(fig.data[block])
+            trace.update(trace_properties)
+            if hoverable:
+                trace.update(hovertemplate=hovertemplate, hoverinfo="text")
+            else:  # The legend entry is the selected part's (in the same legend group)
+                trace.update(hovertemplate=None, hoverinfo="skip", showlegend=False)
+            traces.append(trace)
+        fig = go.Figure(data=traces, layout=fig.layout)
         
         # Set map to dark mode & return figure
         fig.update_layout(map=dict(style="dark"), font_color="#bcbcbc")  # Dark, Light, Satelite
         fig.update_layout(margin=dict(l=0, r=0, t=40, b=0),paper_bgcolor="#2C353C")
+        if lod:
+            fig.update_layout(uirevision="lod")  # Keep the user's zoom and position when the points in view are redrawn
 
-        return fig
+        return fig, new_state
 
-    return _render_default(all_data, id)
+    if map_arrays()["lod"]:
+        default_figure = _cluster_figure(all_data.assign(selected=1, highlighted=GRAYED_OUT_COLOR), map_arrays()["uid_positions"].get_indexer(all_data["UID"]),
+                                         DEFAULT_ZOOM, map_arrays()["clusters"])
+    else:
+        default_figure = None
+    return html.Div(children=[_render_default(all_data, id, default_figure), dcc.Store(id="map_state")])
+
+def _has_view(relayout_data: dict | None) -> bool:
+    '''
+    Returns whether a relayout event changed the view of the map (its zoom level or visible area).
+    '''
+    return bool(relayout_data) and ("map.zoom" in relayout_data or "map._derived" in relayout_data)
+
+def _map_view(relayout_data: dict | None, previous: dict | None = None) -> dict:
+    '''
+    Returns the zoom level and the visible [west, south, east, north] bounds of the map, from its latest relayoutData
+    where it has them and from the previous view otherwise.
+    The bounds are None until the map has been moved (the initial view shows all incidents anyway).
+    '''
+    relayout_data = relayout_data or {}
+    previous = previous or {"zoom": DEFAULT_ZOOM, "bounds": None}
+    zoom = relayout_data.get("map.zoom", previous["zoom"])
+    corners = (relayout_data.get("map._derived") or {}).get("coordinates")
+    if not corners:
+        return {"zoom": zoom, "bounds": previous["bounds"]}
+    longitudes, latitudes = zip(*corners)
+    return {"zoom": zoom, "bounds": [min(longitudes), min(latitudes), max(longitudes), max(latitudes)]}
+
+# One marker per grid cell with the number of selected incidents in it; cells with highlighted incidents are drawn on top
+def _hover_parts(trace_rows: list, selected: np.ndarray, on_top: np.ndarray | None = None) -> list[tuple]:
+    '''
+    Splits the rows of every trace into its unselected rows (which cannot be hovered) and its selected rows.
+    Returns (trace index, rows, hoverable) for every part, also empty ones, so the number of parts only depends on
+    the number of traces. The unselected parts of all traces come first, so they are drawn below the selected points.
+    If on_top is given (a boolean mask over the rows), the selected rows in it are split off into parts drawn last.
+    '''
+    parts = [(block, rows[~selected[rows]], False) for block, rows in enumerate(trace_rows)]
+    if on_top is None:
+        return parts + [(block, rows[selected[rows]], True) for block, rows in enumerate(trace_rows)]
+    for top in (False, True):
+        parts += [(block, rows[selected[rows] & (on_top[rows] == top)], True) for block, rows in enumerate(trace_rows)]
+    return parts
+
+def _cluster_figure(data: DataFrame, positions: np.ndarray, zoom: float, clusters: GridClusters) -> go.Figure:
+    selected = data['selected'].to_numpy() == 1
+    highlighted = data['highlighted'].to_numpy() != GRAYED_OUT_COLOR
+    cells = clusters.clusters(zoom, positions[selected], highlighted[selected].astype(float))
+    fig = go.Figure(go.Scattermap(
+        lat=cells["latitude"], lon=cells["longitude"], mode="markers",
+        marker=dict(size=6 + 4 * np.log2(cells["count"]), color=GRAYED_OUT_COLOR, opacity=0.8),
+        customdata=np.column_stack([np.full(len(cells["count"]), -1), cells["count"]]),  # No UID (-1): clusters are not incidents
+        hovertemplate="%{customdata[1]} incidents<extra></extra>", name=""
+    ))
+    if highlighted.any():
+        has_highlighted = cells["weight"] > 0
+        fig.add_trace(go.Scattermap(
+            lat=cells["latitude"][has_highlighted], lon=cells["longitude"][has_highlighted], mode="markers",
+            marker=dict(size=6 + 4 * np.log2(cells["weight"][has_highlighted]), color=data['highlighted'].to_numpy()[highlighted][0]),
+            customdata=np.column_stack([np.full(np.count_nonzero(has_highlighted), -1), cells["weight"][has_highlighted].astype(int)]),
+            hovertemplate="%{customdata[1]} highlighted incidents<extra></extra>", name=""
+        ))
+    fig.update_layout(map=dict(style="dark", zoom=DEFAULT_ZOOM,
+                               center=dict(lat=float(np.mean(cells["latitude"])) if len(cells["count"]) else 0,
+                                           lon=float(np.mean(cells["longitude"])) if len(cells["count"]) else 0)),
+                      font_color="#bcbcbc", showlegend=False, uirevision="lod")
+    fig.update_layout(margin=dict(l=0, r=0, t=40, b=0),paper_bgcolor="#2C353C")
+    return fig
+
+# Values of the per-point trace properties that change between store updates, for the points of one trace
+def _trace_properties(trace_data: DataFrame, customdata: np.ndarray, mode: str) -> dict:
+    properties = {
+        "lat": trace_data['Latitude'].to_numpy(),  # The points in a trace change with the selection and year window
+        "lon": trace_data['Longitude'].to_numpy(),
+        "marker.opacity": trace_data['selected'].to_numpy(),  # Reduce opacity of unselected points
+        "customdata": customdata,  # Grouped values (e.g. "~Other") can change between updates
+        "hovertext": trace_data['Shark.name'].to_numpy()  # Hover title (hover_name), which can be grouped too
+    }
+    if mode == "highlight":
+        properties["marker.color"] = trace_data['highlighted'].tolist()
+    return properties
 
+def _customdata(data: DataFrame, base_customdata: np.ndarray, uid_positions: pd.Index) -> np.ndarray:
+    '''
+    Returns the custom data of the rows of data (in the same order), taking the values that never change from the
+    precomputed base_customdata and only copying the selection and (possibly grouped) columns from data.
+    '''
+    customdata = base_customdata[uid_positions.get_indexer(data["UID"])]
+    for feature in DYNAMIC_CUSTOM_DATA:
+        customdata[:, GLOBAL_CUSTOM_DATA.index(feature)] = data[feature].to_numpy()
+    return customdata
+
+def _fingerprint(value) -> str:
+    digest = hashlib.sha1()
+    for part in (value if isinstance(value, list) else [value]):
+        if isinstance(part, np.ndarray) and part.dtype != object:
+            digest.update(part.tobytes())
+        elif isinstance(part, np.ndarray):
+            digest.update(json.dumps(part.tolist(), default=str).encode())
+        else:
+            digest.update(json.dumps(part, default=str).encode())
+    return digest.hexdigest()
+
+def _patch_figure(properties: list, new_hashes: list, old_hashes: list):
+    patch = Patch()
+    changed = False
+    for index, (trace_properties, new, old) in enumerate(zip(properties, new_hashes, old_hashes)):
+        for name, value in trace_properties.items():
+            if new[name] == old.get(name):
+                continue
+            target = patch["data"][index]
+            for key in name.split(".")[:-1]:
+                target = target[key]
+            target[name.split(".")[-1]] = value
+            changed = True
+    return patch if changed else no_update
+
+# Templates only depend on the color feature, so each one is built once and reused for every update
+@functools.lru_cache(maxsize=None)
 def _get_hover_template(color_feature) -> str:
     if(color_feature in GLOBAL_CUSTOM_DATA):
         titleIndex = GLOBAL_CUSTOM_DATA.index(color_feature)
@@ -117,13 +323,14 @@ def _get_hover_template(color_feature) -> str:
         "Source: %{customdata["+str(GLOBAL_CUSTOM_DATA.index("Data.source"))+"]}"
 
 #Renders a default map with all points included. Nothing special
-def _render_default(data: DataFrame, id: str) -> dcc.Graph:
-    fig = px.scatter_map(data, lat="Latitude", lon="Longitude", hover_name="Shark.name", width=1000, height=860, zoom=3,
-                         custom_data=["UID"],
-                         hover_data=["UID","Present.at.time.of.bite", "Shark.behaviour","Victim.injury","Injury.location","Diversionary.action.taken"],
-                         color=None)
-    fig.update_layout(map=dict(style="dark"), font_color="#bcbcbc")  # Dark, Light, Satelite
-    fig.update_layout(margin=dict(l=0, r=0, t=40, b=0),paper_bgcolor="#2C353C")
+def _render_default(data: DataFrame, id: str, fig: go.Figure | None = None) -> dcc.Graph:
+    if fig is None:  # A given figure is the level-of-detail view of a large dataset (see _cluster_figure)
+        fig = px.scatter_map(data, lat="Latitude", lon="Longitude", hover_name="Shark.name", width=1000, height=860, zoom=3,
+                             custom_data=["UID"],
+                             hover_data=["UID","Present.at.time.of.bite", "Shark.behaviour","Victim.injury","Injury.location","Diversionary.action.taken"],
+                             color=None)
+        fig.update_layout(map=dict(style="dark"), font_color="#bcbcbc")  # Dark, Light, Satelite
+        fig.update_layout(margin=dict(l=0, r=0, t=40, b=0),paper_bgcolor="#2C353C")
     return dcc.Graph(figure=fig, id=id, style={
             "width": "100%",    # Make the graph take full width of the parent container
             "height": "95vh",   # Height dynamically adjusts to 75% of the viewport height
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+"""
+Load-time schema of the incident dataset.
+Every text column that can be plotted or grouped is converted once to a pandas Categorical with a fixed, canonical
+category order: calendar order for Incident.month, alphabetical for everything else, always followed by the reserved
+"~Other" category that low-frequency values are grouped into (see grouping.py).
+Sorting, grouping and comparing these columns then works on their integer codes, and every component orders the
+values the same way without special-casing months. Numeric columns (e.g. Incident.year) are left as they are.
+Run `python -m benchmarks.memory_footprint` for the memory used by each column before and after the conversion.
+"""
+
+OTHER_LABEL = "~Other"
+MONTHS = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+CATEGORY_ORDERS = {"Incident.month": MONTHS}  # Columns whose values are not ordered alphabetically
+
+def categorical_dtype(values: pd.Series, order: list | None = None) -> pd.CategoricalDtype:
+    '''
+    Returns the canonical categorical type for a column: its values in the given order (values missing from order
+    come after it, alphabetically), or alphabetically if no order is given, followed by "~Other".
+    '''
+    distinct = sorted(set(values.dropna()) - {OTHER_LABEL})
+    if order is not None:
+        distinct = [value for value in order if value in distinct] + [value for value in distinct if value not in order]
+    return pd.CategoricalDtype(distinct + [OTHER_LABEL])
+
+def encode_categories(data: DataFrame, columns: list[str]) -> DataFrame:
+    '''
+    Returns data with the given text columns converted to categoricals in their canonical order.
+    Numeric columns, columns that are not in data and columns that are already categorical are left unchanged.
+    '''
+    dtypes = {}
+    for column in dict.fromkeys(columns):  # Unique, in order
+        if column not in data or isinstance(data[column].dtype, pd.CategoricalDtype) or pd.api.types.is_numeric_dtype(data[column]):
+            continue
+        dtypes[column] = categorical_dtype(data[column], CATEGORY_ORDERS.get(column))
+    return data.astype(dtypes) if dtypes else data
+
+def restore_categories(data: DataFrame, reference: DataFrame) -> DataFrame:
+    '''
+    Converts the columns of data that are categorical in reference back to the same categorical type
+    (e.g. after a round trip through JSON, which only keeps the values).
+    '''
+    dtypes = {column: dtype for column, dtype in reference.dtypes.items()
+              if isinstance(dtype, pd.CategoricalDtype) and column in data and data[column].dtype != dtype}
+    return data.astype(dtypes) if dtypes else data
+
+def extend_categories(frame: DataFrame, delta: DataFrame) -> tuple[DataFrame, DataFrame, list[str]]:
+    '''
+    Converts the columns of delta that are categorical in frame to the same categorical type, for appending delta to frame.
+    If delta has values that are not categories yet, the column's categories are extended (still in canonical order) in
+    both frames; the codes of frame are remapped, not recomputed from the values. Also returns the columns that were extended.
+    '''
+    extended = []
+    frame_dtypes, delta_dtypes = {}, {}
+    for column, dtype in frame.dtypes.items():
+        if not isinstance(dtype, pd.CategoricalDtype) or column not in delta:
+            continue
+        values = pd.Index(delta[column].dropna().unique())
+        new_values = values[dtype.categories.get_indexer(values) == -1]
+        if len(new_values) > 0:
+            values = pd.Series(dtype.categories.append(new_values))
+            dtype = categorical_dtype(values, CATEGORY_ORDERS.get(column))
+            frame_dtypes[column] = dtype
+            extended.append(column)
+        delta_dtypes[column] = dtype
+    frame = frame.assign(**{column: frame[column].cat.set_categories(dtype.categories) for column, dtype in frame_dtypes.items()})
+    return frame, delta.astype(delta_dtypes) if delta_dtypes else delta, extended
+
+def category_codes(values: pd.Series) -> tuple[np.ndarray, pd.Index]:
+    '''
+    Returns an integer code per value (-1 if missing) and the values the codes stand for, in canonical order.
+    For categorical columns these are the category codes (without the reserved "~Other"); other columns are factorized in sorted order.
+    '''
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        categories = values.cat.categories
+        if len(categories) > 0 and categories[-1] == OTHER_LABEL:
+            categories = categories[:-1]
+        return values.cat.codes.to_numpy(), categories
+    return pd.factorize(values, sort=True)
+
+def observed_values(values: pd.Series) -> list:
+    '''
+    Returns the distinct (non-missing) values that occur in values, in canonical order.
+    '''
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes = np.unique(values.cat.codes.to_numpy())
+        return values.cat.categories[codes[codes >= 0]].tolist()
+    distinct = sorted(values.dropna().unique().tolist())
+    order = CATEGORY_ORDERS.get(values.name)
+    if order is not None:
+        distinct = sorted(distinct, key=lambda value: order.index(value) if value in order else len(order))
+    return distinct
+
+def memory_footprint(data: DataFrame) -> pd.Series:
+    '''
+    Returns the memory used by every column of data in bytes, including the text values themselves.
+    '''
+    return data.memory_usage(deep=True, index=False)
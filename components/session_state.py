@@ -0,0 +1,126 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from pandas import DataFrame
+
+"""
+Interaction state kept on the server per browser session (every page load gets its own session id, see data_cleaning.py):
+the filtered dataframes of STORE_MODE = "server", the resolved map selection of the data store and the stacked bar figures.
+Entries are stored per (session, name), and a session only ever reads its own entries, so concurrent users never see
+each other's state.
+Growth is bounded in two ways: an entry expires TTL seconds after it was last used, and all sessions together hold at
+most MEMORY_BUDGET bytes; when a new entry does not fit, the least recently used entries of any session are evicted first.
+stats() reports the sessions, entries and bytes held, and the hits, misses, evictions and expirations so far.
+"""
+
+SESSION_TTL = 30 * 60  # Seconds an entry is kept after it was last used
+MEMORY_BUDGET = 256 * 1024 * 1024  # Bytes, for all sessions together
+
+class SessionState:
+    def __init__(self, ttl: float = SESSION_TTL, memory_budget: int = MEMORY_BUDGET, clock=time.monotonic):
+        self.ttl = ttl
+        self.memory_budget = memory_budget
+        self._clock = clock
+        # (session, name) -> (value, size in bytes, time of last use), least recently used first.
+        # Every use moves an entry to the end, so the entries are also in order of expiry.
+        self._entries = OrderedDict()
+        self._session_entries = {}  # Session -> number of entries
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._lock = threading.Lock()
+
+    def get(self, session: str | None, name, default=None):
+        '''
+        Returns the value session stored under name (marking it as recently used), or default if there is none (any more).
+        '''
+        with self._lock:
+            self._expire()
+            entry = self._entries.get((session, name))
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries[(session, name)] = (entry[0], entry[1], self._clock())
+            self._entries.move_to_end((session, name))
+            self.hits += 1
+            return entry[0]
+
+    def put(self, session: str | None, name, value, size: int | None = None):
+        '''
+        Stores value under name for session, evicting the least recently used entries if the memory budget is exceeded.
+        size is the memory the value uses in bytes (estimated with size_of if not given); a value larger than the whole
+        budget is not stored.
+        '''
+        size = size_of(value) if size is None else size
+        with self._lock:
+            self._expire()
+            self._remove((session, name))
+            if size > self.memory_budget:
+                self.evictions += 1
+                return
+            while self.bytes + size > self.memory_budget:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            self._entries[(session, name)] = (value, size, self._clock())
+            self._session_entries[session] = self._session_entries.get(session, 0) + 1
+            self.bytes += size
+
+    def drop(self, session: str | None):
+        '''
+        Removes all entries of session.
+        '''
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == session]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._session_entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._expire()
+            return {"sessions": len(self._session_entries), "entries": len(self._entries), "bytes": self.bytes,
+                    "memory_budget": self.memory_budget, "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "expirations": self.expirations}
+
+    def _expire(self):
+        # Removes the entries that have not been used for ttl seconds; the caller holds the lock
+        deadline = self._clock() - self.ttl
+        while self._entries:
+            key, (_, _, last_use) = next(iter(self._entries.items()))
+            if last_use > deadline:
+                break
+            self._remove(key)
+            self.expirations += 1
+
+    def _remove(self, key):
+        # The caller holds the lock
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.bytes -= entry[1]
+        self._session_entries[key[0]] -= 1
+        if self._session_entries[key[0]] == 0:
+            del self._session_entries[key[0]]
+
+def size_of(value) -> int:
+    '''
+    Estimates the memory used by value in bytes. Dataframes count the columns they share with other dataframes
+    (e.g. with the base data) as if they were their own, and text in object columns only as references.
+    '''
+    if isinstance(value, DataFrame):
+        return int(value.memory_usage(index=True).sum())
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(size_of(item) for item in value)
+    return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))  # E.g. figures
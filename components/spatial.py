@@ -0,0 +1,150 @@
+import numpy as np
+
+"""
+Spatial helpers for the scatter map.
+GridClusters divides the map into square grid cells per zoom level, so large datasets can be drawn as one cluster
+marker per cell (with the number of incidents in it) instead of one marker per incident. The cell of every incident
+is computed once per zoom level; each update then only counts the visible, selected incidents per cell with a bincount.
+"""
+
+CELLS_PER_TILE = 4  # Grid cells along one side of a 256px map tile, i.e. roughly one cluster per 64px
+MAX_ZOOM = 16
+
+class GridClusters:
+    def __init__(self, latitude: np.ndarray, longitude: np.ndarray):
+        self.latitude = np.asarray(latitude, dtype=float)
+        self.longitude = np.asarray(longitude, dtype=float)
+        self._levels = {}  # Zoom level -> (cell code per incident, number of cells); filled on first use
+
+    def cells(self, zoom: float) -> tuple[np.ndarray, int]:
+        '''
+        Returns the grid cell code of every incident at the given zoom level, and the number of distinct cells.
+        '''
+        level = int(min(max(zoom, 0), MAX_ZOOM))
+        if level not in self._levels:
+            size = 360 / (2 ** level * CELLS_PER_TILE)  # Cell size in degrees
+            column = np.floor((self.longitude + 180) / size).astype(np.int64)
+            row = np.floor((self.latitude + 90) / size).astype(np.int64)
+            keys = row * (2 ** level * CELLS_PER_TILE + 1) + column
+            unique_keys, codes = np.unique(keys, return_inverse=True)
+            self._levels[level] = (codes.astype(np.int32), len(unique_keys))
+        return self._levels[level]
+
+    def clusters(self, zoom: float, positions: np.ndarray, weights: np.ndarray | None = None) -> dict:
+        '''
+        Aggregates the incidents at the given positions (indices into the arrays this grid was built from) per grid cell.
+        Returns the mean latitude/longitude and the number of incidents of every non-empty cell, and, if weights are given
+        (e.g. whether each incident is highlighted), the sum of the weights per cell.
+        '''
+        codes, n_cells = self.cells(zoom)
+        cell = codes[positions]
+        counts = np.bincount(cell, minlength=n_cells)
+        occupied = counts > 0
+        result = {
+            "count": counts[occupied],
+            "latitude": np.bincount(cell, weights=self.latitude[positions], minlength=n_cells)[occupied] / counts[occupied],
+            "longitude": np.bincount(cell, weights=self.longitude[positions], minlength=n_cells)[occupied] / counts[occupied],
+        }
+        if weights is not None:
+            result["weight"] = np.bincount(cell, weights=weights, minlength=n_cells)[occupied]
+        return result
+
+def in_bounds(latitude: np.ndarray, longitude: np.ndarray, bounds: tuple | None) -> np.ndarray:
+    '''
+    Returns a boolean mask of the points inside bounds = (west, south, east, north); everything is inside if bounds is None.
+    '''
+    if bounds is None:
+        return np.ones(len(latitude), dtype=bool)
+    west, south, east, north = bounds
+    return (longitude >= west) & (longitude <= east) & (latitude >= south) & (latitude <= north)
+
+class GridIndex:
+    def __init__(self, latitude: np.ndarray, longitude: np.ndarray, cell_size: float = 1.0):
+        '''
+        Uniform grid over the incidents for selection queries: the positions of the incidents are sorted by grid cell,
+        so the candidates for a selection are the incidents in the occupied cells overlapping its bounding box.
+        '''
+        self.latitude = np.asarray(latitude, dtype=float)
+        self.longitude = np.asarray(longitude, dtype=float)
+        self.cell_size = cell_size
+        keys = self._keys(self.latitude, self.longitude)
+        self.order = np.argsort(keys, kind="stable")  # Incident positions, grouped by cell
+        self.sorted_keys = keys[self.order]
+        self._find_cells()
+
+    def _keys(self, latitude: np.ndarray, longitude: np.ndarray) -> np.ndarray:
+        # Cell of every point as a single number, in row-major order on a fixed grid over the whole globe,
+        # so the keys of points added later can be compared with the existing ones
+        column = np.floor(longitude / self.cell_size).astype(np.int64)
+        row = np.floor(latitude / self.cell_size).astype(np.int64)
+        columns = int(np.ceil(360 / self.cell_size)) + 2  # Longitudes from -180 to 180 (and slightly beyond)
+        return (row + columns) * (2 * columns) + (column + columns)
+
+    def _find_cells(self):
+        starts = np.flatnonzero(np.concatenate([[True], self.sorted_keys[1:] != self.sorted_keys[:-1]])) if len(self.sorted_keys) else np.empty(0, dtype=np.intp)
+        self.cell_start = starts
+        self.cell_stop = np.append(starts[1:], len(self.sorted_keys))
+        positions = self.order[starts]
+        self.cell_column = np.floor(self.longitude[positions] / self.cell_size).astype(np.int64)
+        self.cell_row = np.floor(self.latitude[positions] / self.cell_size).astype(np.int64)
+
+    def inserted(self, slots: np.ndarray, latitude: np.ndarray, longitude: np.ndarray) -> "GridIndex":
+        '''
+        Returns the index of the incidents with the given points inserted before the given positions (see Dataset.inserted).
+        The new points are sorted into the existing cells; the existing incidents are not sorted again.
+        '''
+        index = GridIndex.__new__(GridIndex)
+        index.cell_size = self.cell_size
+        index.latitude = np.insert(self.latitude, slots, np.asarray(latitude, dtype=float))
+        index.longitude = np.insert(self.longitude, slots, np.asarray(longitude, dtype=float))
+        # Existing positions move down by the number of points inserted before them
+        shifted = self.order + np.searchsorted(slots, self.order, side="right")
+        keys = self._keys(np.asarray(latitude, dtype=float), np.asarray(longitude, dtype=float))
+        new_order = np.argsort(keys, kind="stable")
+        at = np.searchsorted(self.sorted_keys, keys[new_order], side="right")
+        index.order = np.insert(shifted, at, (slots + np.arange(len(slots)))[new_order])
+        index.sorted_keys = np.insert(self.sorted_keys, at, keys[new_order])
+        index._find_cells()
+        return index
+
+    def candidates(self, west: float, south: float, east: float, north: float) -> np.ndarray:
+        '''
+        Returns the positions of the incidents in the grid cells overlapping the given bounding box.
+        '''
+        overlapping = np.flatnonzero((self.cell_column >= np.floor(west / self.cell_size)) & (self.cell_column <= np.floor(east / self.cell_size)) &
+                                     (self.cell_row >= np.floor(south / self.cell_size)) & (self.cell_row <= np.floor(north / self.cell_size)))
+        if len(overlapping) == 0:
+            return np.empty(0, dtype=np.intp)
+        return np.concatenate([self.order[start:stop] for start, stop in zip(self.cell_start[overlapping], self.cell_stop[overlapping])])
+
+    def in_box(self, west: float, south: float, east: float, north: float) -> np.ndarray:
+        '''
+        Returns the positions of the incidents inside the given bounding box.
+        '''
+        positions = self.candidates(west, south, east, north)
+        inside = in_bounds(self.latitude[positions], self.longitude[positions], (west, south, east, north))
+        return positions[inside]
+
+    def in_polygon(self, polygon: np.ndarray) -> np.ndarray:
+        '''
+        Returns the positions of the incidents inside the polygon, given as an array of (longitude, latitude) vertices.
+        '''
+        polygon = np.asarray(polygon, dtype=float)
+        positions = self.candidates(polygon[:, 0].min(), polygon[:, 1].min(), polygon[:, 0].max(), polygon[:, 1].max())
+        inside = points_in_polygon(self.longitude[positions], self.latitude[positions], polygon)
+        return positions[inside]
+
+def points_in_polygon(x: np.ndarray, y: np.ndarray, polygon: np.ndarray) -> np.ndarray:
+    '''
+    Even-odd rule point-in-polygon test for many points at once: a point is inside if a ray from it crosses an odd
+    number of polygon edges. Loops over the edges of the polygon, testing all points against each edge at once.
+    '''
+    inside = np.zeros(len(x), dtype=bool)
+    previous = polygon[-1]
+    with np.errstate(divide="ignore", invalid="ignore"):  # Horizontal edges never count as crossings
+        for vertex in polygon:
+            crosses = (vertex[1] > y) != (previous[1] > y)
+            crossing_x = (previous[0] - vertex[0]) * (y - vertex[1]) / (previous[1] - vertex[1]) + vertex[0]
+            inside ^= crosses & (x < crossing_x)
+            previous = vertex
+    return inside
@@ -0,0 +1,139 @@
+import base64
+import zlib
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+from . import schema
+
+try:
+    import pyarrow as pa
+except ImportError:  # pyarrow is optional (see data_loader.py); without it the "arrow" codec falls back to FALLBACK_CODEC
+    pa = None
+try:
+    import msgpack
+except ImportError:  # msgpack is optional; without it the "msgpack" codec falls back to FALLBACK_CODEC
+    msgpack = None
+
+"""
+Codecs that turn a dataframe into a JSON-serializable value for a dcc.Store and back (used by the data store in
+STORE_MODE = "full", see data_cleaning.py). Every encoded value records the codec it was written with, so a reader
+never has to know which codec the writer used:
+    "records" - DataFrame.to_dict(), a {column: {row index: value}} object (the original format; every row index is
+                repeated for every column)
+    "columns" - one JSON array per column and the index once; categorical columns are sent as their categories
+                and an array of integer codes
+    "arrow"   - an Arrow IPC stream (compressed if pyarrow supports it), as a base64 string (needs the optional pyarrow package)
+    "msgpack" - the "columns" layout with the numeric arrays as raw bytes, packed with msgpack, compressed with zlib
+                and base64 encoded (needs the optional msgpack package)
+Run `python -m benchmarks.store_codec_benchmark` for the payload size and encode/decode time of every codec.
+"""
+
+FALLBACK_CODEC = "columns"  # Used instead of a codec whose (optional) package is not installed
+ARROW_COMPRESSION = "zstd" if pa is not None and pa.Codec.is_available("zstd") else None
+ZLIB_LEVEL = 6
+
+def encode(frame: DataFrame, codec: str) -> dict:
+    '''
+    Encodes frame with the given codec and returns {"codec": name, "payload": encoded frame}.
+    Raises ValueError for an unknown codec; a codec that is not available is replaced by FALLBACK_CODEC.
+    '''
+    if codec not in CODECS:
+        raise ValueError("Unknown store codec {!r}, expected one of {}".format(codec, ", ".join(CODECS)))
+    if not available(codec):
+        codec = FALLBACK_CODEC
+    return {"codec": codec, "payload": CODECS[codec][0](frame)}
+
+def decode(value: dict, reference: DataFrame | None = None) -> DataFrame:
+    '''
+    Decodes a value returned by encode (after its round trip through the browser) back into a dataframe.
+    If a reference dataframe is given, columns that are categorical in it get exactly its categorical type again.
+    '''
+    frame = CODECS[value["codec"]][1](value["payload"])
+    return frame if reference is None else schema.restore_categories(frame, reference)
+
+def available(codec: str) -> bool:
+    return {"msgpack": msgpack, "arrow": pa}.get(codec, True) is not None
+
+### Records (original format) ###
+def _encode_records(frame: DataFrame) -> dict:
+    return frame.to_dict()
+
+def _decode_records(payload: dict) -> DataFrame:
+    return DataFrame(payload)
+
+### Column arrays ###
+# {"index": {"start", "stop"} or [labels], "columns": {name: column}}, where a column is one of
+#     {"categories": [...], "codes": array}    for categorical columns (code -1 is a missing value)
+#     {"dtype": numpy dtype, "values": array}  for numeric columns
+#     {"values": [...]}                        for everything else (e.g. text), missing values as None
+# The arrays are JSON lists, or raw bytes if binary (for msgpack, which stores bytes as they are).
+def _encode_columns(frame: DataFrame, binary: bool = False) -> dict:
+    columns = {}
+    for name, values in frame.items():
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            codes = values.cat.codes.to_numpy()
+            columns[name] = {"categories": values.cat.categories.tolist(), "dtype": codes.dtype.str, "codes": _pack(codes, binary)}
+        elif pd.api.types.is_numeric_dtype(values.dtype) and not pd.api.types.is_extension_array_dtype(values.dtype):
+            array = values.to_numpy()
+            columns[name] = {"dtype": array.dtype.str, "values": _pack(array, binary)}
+        else:
+            columns[name] = {"values": values.astype(object).where(values.notna(), None).tolist()}
+    if isinstance(frame.index, pd.RangeIndex) and frame.index.step == 1:
+        index = {"start": frame.index.start, "stop": frame.index.stop}  # No need to send every row index
+    else:
+        index = frame.index.tolist()
+    return {"index": index, "columns": columns}
+
+def _decode_columns(payload: dict, binary: bool = False) -> DataFrame:
+    index = payload["index"]
+    index = pd.RangeIndex(index["start"], index["stop"]) if isinstance(index, dict) else pd.Index(index)
+    columns = {}
+    for name, column in payload["columns"].items():
+        if "categories" in column:
+            codes = _unpack(column["codes"], column["dtype"], binary)
+            columns[name] = pd.Categorical.from_codes(codes, categories=column["categories"])
+        elif "dtype" in column:
+            columns[name] = _unpack(column["values"], column["dtype"], binary)
+        else:
+            columns[name] = column["values"]
+    return DataFrame(columns, index=index)
+
+def _pack(array: np.ndarray, binary: bool):
+    if binary:
+        return np.ascontiguousarray(array).tobytes()
+    if array.dtype.kind == "f":  # JSON has no NaN; missing values become null
+        return np.where(np.isnan(array), None, array).tolist()
+    return array.tolist()
+
+def _unpack(values, dtype: str, binary: bool) -> np.ndarray:
+    if binary:
+        return np.frombuffer(values, dtype=np.dtype(dtype))
+    return np.array([np.nan if value is None else value for value in values] if np.dtype(dtype).kind == "f" else values,
+                    dtype=np.dtype(dtype))
+
+### Arrow IPC ###
+def _encode_arrow(frame: DataFrame) -> str:
+    table = pa.Table.from_pandas(frame)  # A RangeIndex is only stored as metadata
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema, options=pa.ipc.IpcWriteOptions(compression=ARROW_COMPRESSION)) as writer:
+        writer.write_table(table)
+    return base64.b64encode(sink.getvalue()).decode("ascii")
+
+def _decode_arrow(payload: str) -> DataFrame:
+    return pa.ipc.open_stream(base64.b64decode(payload)).read_all().to_pandas()
+
+### Compressed msgpack ###
+def _encode_msgpack(frame: DataFrame) -> str:
+    packed = msgpack.packb(_encode_columns(frame, binary=True))
+    return base64.b64encode(zlib.compress(packed, ZLIB_LEVEL)).decode("ascii")
+
+def _decode_msgpack(payload: str) -> DataFrame:
+    return _decode_columns(msgpack.unpackb(zlib.decompress(base64.b64decode(payload))), binary=True)
+
+# Name -> (encode, decode)
+CODECS = {
+    "records": (_encode_records, _decode_records),
+    "columns": (_encode_columns, _decode_columns),
+    "arrow": (_encode_arrow, _decode_arrow),
+    "msgpack": (_encode_msgpack, _decode_msgpack),
+}
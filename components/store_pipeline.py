@@ -0,0 +1,55 @@
+import threading
+import time
+from .session_state import SessionState, size_of
+
+"""
+Runs the data store computation as a chain of stages, each memoized per browser session on its own inputs:
+year window -> map selection -> low-frequency grouping -> highlight.
+The key of a stage includes the key of the stage before it, so a stage is only computed again when its own inputs or
+anything upstream changed: a click on the stacked bar or the parcat plot only recomputes the highlight, and moving the
+year window reuses the resolved map selection. Only the latest result of every stage is kept per session, in the
+session's server-side state (see session_state.py), so it expires and is evicted like the rest of that state.
+stats() reports per stage how often it was computed or reused and how long the computations took.
+"""
+
+STAGES = ["window", "selection", "grouping", "highlight"]
+
+class StorePipeline:
+    def __init__(self, state: SessionState, stages: list[str] = STAGES):
+        self.state = state
+        self.stages = stages
+        self._timings = {stage: [0, 0, 0.0, 0.0] for stage in stages}  # Stage -> [runs, hits, total seconds, seconds of the last run]
+        self._lock = threading.Lock()
+
+    def run(self, session: str | None, stage: str, key, compute):
+        '''
+        Returns the result of stage for key: the session's last result of that stage if it was computed for the same key,
+        otherwise the result of compute(), which is then kept as the session's latest result of the stage.
+        key must describe all inputs of the stage, including the key of the stage before it.
+        '''
+        memo = self.state.get(session, ("stage", stage))
+        if memo is not None and memo[0] == key:
+            with self._lock:
+                self._timings[stage][1] += 1
+            return memo[1]
+        start = time.perf_counter()
+        value = compute()
+        duration = time.perf_counter() - start
+        self.state.put(session, ("stage", stage), (key, value), size=size_of(key) + size_of(value))
+        with self._lock:
+            timings = self._timings[stage]
+            timings[0] += 1
+            timings[2] += duration
+            timings[3] = duration
+        return value
+
+    def stats(self) -> dict:
+        '''
+        Returns, per stage, the number of computations (runs) and reuses (hits), and the total and last computation time.
+        '''
+        with self._lock:
+            stats = {}
+            for stage, (runs, hits, total, last) in self._timings.items():
+                stats.update({stage + "_runs": runs, stage + "_hits": hits,
+                              stage + "_seconds_total": total, stage + "_last_seconds": last})
+            return stats
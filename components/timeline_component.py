@@ -1,107 +1,94 @@
-from dash import Dash, html, dcc, Input, Output
+from dash import Dash, html, dcc, Input, Output, State
+import numpy as np
 import pandas as pd
 from pandas import DataFrame
 import plotly.express as px
 import plotly.graph_objects as go
+from . import dataset
 
-def valAndFreqs(dataList):
-    val = []  
-    for item in dataList:  
-        if item not in val:  
-            val.append(item)  
-    
-    freq = [0] * len(val)
-    for x in range(len(freq)):
-        for item in dataList:
-            if item == val[x]:
-                freq[x]+=1
-    valsAndfreqs = (val,freq)
-    return valsAndfreqs
+"""
+Renders the incident histogram above the year slider.
+The number of incidents per year is counted once when the component is created, as a dense array indexed by
+year - first year (and kept up to date by the base data when incidents are added, see ingest.py).
+A slider update then only slices that array.
+In client-side mode (CLIENTSIDE = True) the counts are embedded in the layout once, and the browser updates the
+highlighted area and the title itself while the slider is dragged, without any requests to the server.
+"""
+
+CLIENTSIDE = True
+
+# Recomputes the selected (blue) area and the title from the embedded counts, for the slider value being dragged
+UPDATE_TIMELINE_JS = """
+function(drag_value, value, counts, figure) {
+    var range = drag_value || value;
+    var x = [], y = [];
+    for (var i = 0; i < counts.years.length; i++) {
+        if (counts.years[i] >= range[0] && counts.years[i] <= range[1]) {
+            x.push(counts.years[i]);
+            y.push(counts.counts[i]);
+        }
+    }
+    var data = figure.data.slice();
+    data[1] = Object.assign({}, data[1], {x: x, y: y});
+    return [Object.assign({}, figure, {data: data}), "Incidents from years: " + range[0] + " until " + range[1]];
+}
+"""
 
 def render(app: Dash, data: DataFrame, id: str) -> html.Div:
 
     years = data["Incident.year"]
-    min_year, max_year = years.min(), years.max()
+    min_year, max_year = int(years.min()), int(years.max())
 
-    # Define the callback to update the title based on slider value
-    @app.callback(
-        Output('timetitle', 'children'), # Output the updated title to the H6 element
-        Input('slider', 'value')         # Input: the slider value
-    )
-    def update_title(input_year):
-        # Get the start and end year from the slider value
-        start_year, end_year = input_year
-        return f"Incidents from years: {start_year} until {end_year}"
-    
-    @app.callback(
-        Output('timehist', 'figure'), # Output the updated histogram above the slider
-        Input('slider', 'value')      # Input: the slider value
-    )
+    # Number of incidents in every year from min_year until max_year (0 for years without incidents)
+    year_counts = np.bincount(years.to_numpy() - min_year, minlength=max_year - min_year + 1)
 
-    def update_graph(input_year):
-        # Filtered dynamic data
-        filtered_data = data[(data['Incident.year'] >= input_year[0]) & (data['Incident.year'] <= input_year[1])]
-
-        dyn_years, dyn_val = valAndFreqs(filtered_data["Incident.year"])
-        stat_years, stat_val = valAndFreqs(years)
-
-        dyn_years, dyn_val = valAndFreqs(filtered_data["Incident.year"])
-        stat_years, stat_val = valAndFreqs(years)
-
-        dynamic_area = go.Scatter(
-            x=dyn_years,
-            y=dyn_val,
-            fill='tozeroy',  # Fill to the x-axis
-            fillcolor='rgba(0, 0, 255, 0.7)',  # Blue with some opacity
-            mode='lines',
-            line=dict(color='blue'),
-            name="",
-            hovertemplate="<b>Selected years:</b><br>Year: %{x}<br>Incidents: %{y}<br>%{fullData.name}" 
-        )
+    def current_counts() -> tuple[int, np.ndarray]:
+        # Incidents can be added while the app runs (see ingest.py); the base data keeps its year counts up to date
+        base = dataset.current()
+        return (min_year, year_counts) if base is None else (base.first_year, base.year_counts)
 
-        # Static area plot for full data (use grey)
-        static_area = go.Scatter(
-            x=stat_years,
-            y=stat_val,
-            fill='tozeroy',  # Fill to the x-axis
-            fillcolor='rgba(128, 128, 128, 0.4)',  # Grey with opacity
-            mode='lines',
-            line=dict(color='grey'),
-            name="",
-            hovertemplate="<b>Unselected years:</b><br>Year: %{x}<br>Incidents: %{y}<br>%{fullData.name}" 
+    if CLIENTSIDE:
+        app.clientside_callback(
+            UPDATE_TIMELINE_JS,
+            Output('timehist', 'figure'),
+            Output('timetitle', 'children'),
+            Input('slider', 'drag_value'),      # Updated continuously while dragging
+            Input('slider', 'value'),
+            State('timeline_counts', 'data'),
+            State('timehist', 'figure')
+        )
+    else:
+        # Define the callback to update the title based on slider value
+        @app.callback(
+            Output('timetitle', 'children'), # Output the updated title to the H6 element
+            Input('slider', 'value')         # Input: the slider value
         )
+        def update_title(input_year):
+            # Get the start and end year from the slider value
+            start_year, end_year = input_year
+            return f"Incidents from years: {start_year} until {end_year}"
 
-        # Combine both traces in a single figure
-        fig = go.Figure(data=[static_area, dynamic_area])
-        fig.update_layout(
-            yaxis_title="Incidents",
-            yaxis=dict(title_standoff=5),
-            barmode='overlay',  
-            xaxis_title=None, 
-            xaxis=dict(showticklabels=False),
-            showlegend=False, 
-            paper_bgcolor="#2C353C",
-            font=dict(color='#bcbcbc'),
-            margin=dict(l=30,r=45,t=10,b=20),
-            height = 200
+        @app.callback(
+            Output('timehist', 'figure'), # Output the updated histogram above the slider
+            Input('slider', 'value')      # Input: the slider value
         )
-        return fig
-        
+        def update_graph(input_year):
+            return make_figure(*current_counts(), input_year)
 
     return html.Div(
             children = [
                 html.H5(id = "timetitle", children = f"Incidents from years: {min_year} until {max_year}", className="timetitle", style={'textAlign': 'center'}),
-                dcc.Graph(id = "timehist", className="timehist"),   
+                dcc.Graph(id = "timehist", className="timehist", figure=make_figure(min_year, year_counts, [min_year, max_year])),
+                # Incidents per year (years with incidents only), for the client-side callback
+                dcc.Store(id = "timeline_counts", data=counts_data(min_year, year_counts)),
                 html.Div(
                 dcc.RangeSlider(
                     min=min_year,
                     max=max_year,
                     step=1,
                     value=[min_year, max_year],
-                    marks={
-                        str(year): {'label': str(year), 'style': {'transform': 'rotate(45deg)', 'whiteSpace': 'nowrap'}}
-                        for year in range(max_year, min_year, -10)
-                    },
+                    updatemode="mouseup",  # value (and so the data store) only changes on release; drag_value previews while dragging
+                    marks=slider_marks(min_year, max_year),
                     id="slider",
                     className="timeslider"
                 ),
@@ -117,4 +104,68 @@ def render(app: Dash, data: DataFrame, id: str) -> html.Div:
             'padding': '10px',
             'margin-top': '15px',
         }
-        )
\ No newline at end of file
+        )
+
+def make_figure(first_year: int, year_counts: np.ndarray, input_year) -> go.Figure:
+    '''
+    Returns the histogram of the incidents per year (year_counts[i] incidents in year first_year + i),
+    with the years selected on the slider in blue.
+    '''
+    all_years = np.arange(first_year, first_year + len(year_counts))
+    has_incidents = year_counts > 0  # Only years with incidents are plotted
+
+    # Static area plot for full data (use grey)
+    static_area = go.Scatter(
+        x=all_years[has_incidents],
+        y=year_counts[has_incidents],
+        fill='tozeroy',  # Fill to the x-axis
+        fillcolor='rgba(128, 128, 128, 0.4)',  # Grey with opacity
+        mode='lines',
+        line=dict(color='grey'),
+        name="",
+        hovertemplate="<b>Unselected years:</b><br>Year: %{x}<br>Incidents: %{y}<br>%{fullData.name}" 
+    )
+
+    # Slice the selected years out of the precomputed counts
+    start = max(input_year[0] - first_year, 0)
+    stop = max(input_year[1] - first_year + 1, start)
+    window = slice(start, stop)
+    window_has_incidents = has_incidents[window]
+
+    dynamic_area = go.Scatter(
+        x=all_years[window][window_has_incidents],
+        y=year_counts[window][window_has_incidents],
+        fill='tozeroy',  # Fill to the x-axis
+        fillcolor='rgba(0, 0, 255, 0.7)',  # Blue with some opacity
+        mode='lines',
+        line=dict(color='blue'),
+        name="",
+        hovertemplate="<b>Selected years:</b><br>Year: %{x}<br>Incidents: %{y}<br>%{fullData.name}" 
+    )
+
+    # Combine both traces in a single figure
+    fig = go.Figure(data=[static_area, dynamic_area])
+    fig.update_layout(
+        yaxis_title="Incidents",
+        yaxis=dict(title_standoff=5),
+        barmode='overlay',  
+        xaxis_title=None, 
+        xaxis=dict(showticklabels=False),
+        showlegend=False, 
+        paper_bgcolor="#2C353C",
+        font=dict(color='#bcbcbc'),
+        margin=dict(l=30,r=45,t=10,b=20),
+        height = 200
+    )
+    return fig
+
+def counts_data(first_year: int, year_counts: np.ndarray) -> dict:
+    # Incidents per year (years with incidents only), as embedded for the client-side callback
+    has_incidents = year_counts > 0
+    return {"years": np.arange(first_year, first_year + len(year_counts))[has_incidents].tolist(), "counts": year_counts[has_incidents].tolist()}
+
+def slider_marks(min_year: int, max_year: int) -> dict:
+    return {
+        str(year): {'label': str(year), 'style': {'transform': 'rotate(45deg)', 'whiteSpace': 'nowrap'}}
+        for year in range(max_year, min_year, -10)
+    }
@@ -0,0 +1,12 @@
+"""
+Gunicorn settings for serving wsgi:server (see wsgi.py); gunicorn reads this file from the working directory.
+Every worker starts its own INGEST_DIR watcher after it is forked, since wsgi.py does not start one (with --preload it
+runs in the master process, which serves no requests).
+"""
+
+def post_fork(server, worker):
+    import wsgi  # Already loaded before the fork with --preload; otherwise this loads the app in the worker now (gunicorn reuses the module)
+    from app import INGEST_DIR
+    from components import ingest
+    if INGEST_DIR:
+        ingest.start(INGEST_DIR)  # Adds the files already in the directory first
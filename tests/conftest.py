@@ -0,0 +1,12 @@
+import os
+import sys
+
+"""
+Shared setup for the tests: the app modules are imported from the repository root, and the data (sharks_clean.xlsx
+and its .cache folder) is read relative to it. Run from the repository root with:
+    python -m pytest tests
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
@@ -0,0 +1,35 @@
+import pytest
+from dash.exceptions import PreventUpdate
+from components.coalescing import Coalescer
+
+"""
+Superseded data store computations stop, but store values only become outdated for the plots once a newer one is delivered.
+"""
+
+def test_newer_computation_supersedes_running_one():
+    coalescer = Coalescer()
+    first = coalescer.begin("tab")
+    coalescer.check("tab", first)
+    second = coalescer.begin("tab")
+    with pytest.raises(PreventUpdate):
+        coalescer.check("tab", first)
+    coalescer.check("tab", second)
+
+def test_value_outdated_only_after_newer_value_is_delivered():
+    coalescer = Coalescer()
+    first = coalescer.begin("tab")
+    coalescer.deliver("tab", first)
+    second = coalescer.begin("tab")  # E.g. stops with PreventUpdate and never returns a value
+    coalescer.check_value("tab", first)  # The browser still holds the first value; the plots must keep using it
+    coalescer.deliver("tab", second)
+    with pytest.raises(PreventUpdate):
+        coalescer.check_value("tab", first)
+    coalescer.check_value("tab", second)
+
+def test_other_sessions_are_independent():
+    coalescer = Coalescer()
+    first = coalescer.begin("tab")
+    coalescer.deliver("tab", first)
+    coalescer.deliver("other", coalescer.begin("other"))
+    coalescer.check_value("tab", first)
+    coalescer.check_value(None, first)
@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+import pytest
+from components import data_cleaning, data_loader, ingest, schema
+from components.stackedbar_component import _make_figure, _plot_combinations
+from app import plotable_columns
+
+"""
+The year count cubes answer the stacked bar chart with the same figure as counting the rows of the year window, and
+a dataset extended with new incidents (see ingest.py) equals the dataset built again from all rows.
+"""
+
+WINDOWS = [(1791, 2024), (1900, 1950), (2000, 2000), (2015, 2024)]
+FEATURE_PAIRS = [("Incident.month", "Victim.injury"), ("State", "Site.category"), ("Shark.name", "Shark.name"),
+                 ("Victim.activity", "Provoked/unprovoked"), ("Data.source", "Injury.severity")]
+
+@pytest.fixture(scope="module")
+def data():
+    return schema.encode_categories(data_loader.load_incidents(), plotable_columns + data_cleaning.GROUPABLE_FEATURES)
+
+@pytest.fixture(scope="module")
+def base(data):
+    return data_cleaning.prepare_dataset(data)
+
+@pytest.mark.parametrize("window", WINDOWS)
+@pytest.mark.parametrize("primary, secondary", FEATURE_PAIRS)
+@pytest.mark.parametrize("normalize", [False, True])
+def test_cube_counts_match_row_counts(base, window, primary, secondary, normalize):
+    rows = base.year_rows(*window)
+    filtered_data, grouped_values = data_cleaning._grouped_window(base, rows, None)
+    combinations = base.count_cubes.combinations(primary, secondary, rows, grouped_values, normalize)
+    assert combinations is not None
+    expected = _make_figure(filtered_data, primary, secondary, normalize, None)
+    actual = _plot_combinations(combinations, primary, secondary, normalize, None)
+    assert actual[1] == expected[1]
+    assert actual[0].to_json() == expected[0].to_json()
+
+def _raw_split(new_values: bool) -> tuple[pd.DataFrame, pd.DataFrame]:
+    # Every fifth incident is added later; with new_values, some of them have a year and values the base data does not have
+    raw = data_loader.load_incidents()
+    added = np.arange(len(raw)) % 5 == 2
+    base_rows, delta = raw[~added], raw[added].copy()
+    if new_values:
+        delta.loc[delta.index[:3], "Incident.year"] = [1700, 2030, 2030]
+        delta.loc[delta.index[3:5], "Shark.name"] = "test shark"
+    return base_rows, delta
+
+def _rebuilt(rows: pd.DataFrame) -> data_cleaning.Dataset:
+    return data_cleaning.prepare_dataset(schema.encode_categories(rows, plotable_columns + data_cleaning.GROUPABLE_FEATURES))
+
+def _cells(index) -> np.ndarray:
+    # Incident positions grouped by cell, in row order within every cell (the order within a cell is not fixed)
+    return index.order[np.lexsort((index.order, index.sorted_keys))]
+
+@pytest.mark.parametrize("new_values", [False, True])
+def test_extended_dataset_equals_rebuilt_dataset(new_values):
+    base_rows, delta = _raw_split(new_values)
+    base = _rebuilt(base_rows)
+    for primary, secondary in FEATURE_PAIRS:  # Cubes in memory are updated with the new rows
+        base.count_cubes.combinations(primary, secondary, (0, len(base)), {}, False)
+    extended = data_cleaning.extend_dataset(base, ingest.validate(delta, base))
+    rebuilt = _rebuilt(pd.concat([base_rows, delta]))  # Rows of a year in the order they were added
+
+    pd.testing.assert_frame_equal(extended.frame, rebuilt.frame)
+    assert extended.version == base.version + 1
+    assert extended.uid_index.equals(rebuilt.uid_index)
+    assert extended.first_year == rebuilt.first_year
+    np.testing.assert_array_equal(extended.year_counts, rebuilt.year_counts)
+    assert extended.year_rows(1950, 2000) == rebuilt.year_rows(1950, 2000)
+
+    np.testing.assert_array_equal(extended.grouping.codes, rebuilt.grouping.codes)
+    for feature in data_cleaning.GROUPABLE_FEATURES:
+        assert pd.Index(extended.grouping.labels[feature]).equals(pd.Index(rebuilt.grouping.labels[feature]))
+
+    extended_index, rebuilt_index = extended.spatial_index, rebuilt.spatial_index
+    np.testing.assert_array_equal(extended_index.sorted_keys, rebuilt_index.sorted_keys)
+    np.testing.assert_array_equal(_cells(extended_index), _cells(rebuilt_index))
+    np.testing.assert_array_equal(extended_index.latitude, rebuilt_index.latitude)
+    np.testing.assert_array_equal(extended_index.longitude, rebuilt_index.longitude)
+    box = (140, -40, 155, -25)
+    np.testing.assert_array_equal(np.sort(extended_index.in_box(*box)), np.sort(rebuilt_index.in_box(*box)))
+    polygon = np.array([[113, -35], [130, -10], [154, -28], [150, -38]])
+    np.testing.assert_array_equal(np.sort(extended_index.in_polygon(polygon)), np.sort(rebuilt_index.in_polygon(polygon)))
+
+    # Cubes of features with new values are built again on first use; the others are updated with the new rows
+    new_features = {feature for pair in FEATURE_PAIRS for feature in pair
+                    if len(set(delta[feature].dropna()) - set(base_rows[feature].dropna())) > 0}
+    updated = 0
+    for primary, secondary in FEATURE_PAIRS:
+        cube = extended.count_cubes._cubes.get((primary, secondary))
+        assert (cube is None) == bool({primary, secondary} & new_features)
+        if cube is not None:
+            np.testing.assert_array_equal(cube, rebuilt.count_cubes._cube(primary, secondary))
+            updated += 1
+        for window in WINDOWS:
+            rows = rebuilt.year_rows(*window)
+            low_freq = rebuilt.grouping.low_freq_codes(rows)
+            pd.testing.assert_frame_equal(extended.count_cubes.combinations(primary, secondary, rows, low_freq, False),
+                                          rebuilt.count_cubes.combinations(primary, secondary, rows, low_freq, False))
+    assert updated > 0
@@ -0,0 +1,24 @@
+import pytest
+from dash.exceptions import PreventUpdate
+from components.lru_cache import LRUCache
+
+"""
+get_or_compute computes a value once per key and leaves no per-key lock behind, also when the computation fails.
+"""
+
+def test_get_or_compute_stores_value():
+    cache = LRUCache(2)
+    assert cache.get_or_compute("a", lambda: 1) == 1
+    assert cache.get_or_compute("a", lambda: 2) == 1
+    assert cache._computing == {}
+
+def test_get_or_compute_releases_key_when_compute_raises():
+    cache = LRUCache(2)
+    def compute():
+        raise PreventUpdate
+    for key in ("a", "b", "c"):
+        with pytest.raises(PreventUpdate):
+            cache.get_or_compute(key, compute)
+    assert cache._computing == {}
+    assert "a" not in cache
+    assert cache.get_or_compute("a", lambda: 1) == 1
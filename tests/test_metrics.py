@@ -0,0 +1,45 @@
+import json
+import app
+from components import data_cleaning
+
+"""
+Starts the app with ENABLE_METRICS switched on and reads /metrics through the Flask test client.
+"""
+
+def test_metrics_endpoint(monkeypatch):
+    monkeypatch.setattr(app, "ENABLE_METRICS", True)
+    client = app.create_app().server.test_client()  # Also registers clientside callbacks, which are not wrapped
+
+    # Any server-side callback is recorded; the column toggle needs no data
+    response = client.post("/_dash-update-component", json={
+        "output": "..left-col.style...right-col.style...toggle-button.children..",
+        "outputs": [{"id": "left-col", "property": "style"}, {"id": "right-col", "property": "style"},
+                    {"id": "toggle-button", "property": "children"}],
+        "inputs": [{"id": "toggle-button", "property": "n_clicks", "value": 1}],
+        "changedPropIds": ["toggle-button.n_clicks"],
+        "state": []})
+    assert response.status_code == 200
+    assert json.loads(response.data)["response"]["toggle-button"]["children"]
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    text = response.data.decode()
+    assert 'dash_callback_calls_total{callback="toggle_columns"' in text
+    assert 'status="ok"} 1' in text
+    for key in data_cleaning.session_state.stats():
+        assert f"session_state_{key} " in text
+    for key in data_cleaning.pipeline.stats():
+        assert f"store_pipeline_{key} " in text
+
+def test_ingest_stats(monkeypatch, tmp_path, caplog):
+    # A file that does not match the data is skipped, logged and counted
+    (tmp_path / "metrics_test_unknown_columns.csv").write_text("Something,Else\n1,2\n")
+    monkeypatch.setattr(app, "ENABLE_METRICS", True)
+    monkeypatch.setattr(app, "INGEST_DIR", str(tmp_path))
+    with caplog.at_level("WARNING", logger="components.ingest"):
+        client = app.create_app().server.test_client()
+    assert "metrics_test_unknown_columns.csv" in caplog.text
+
+    text = client.get("/metrics").data.decode()
+    assert "ingest_files_skipped 1" in text
+    assert "ingest_files_added 0" in text
@@ -0,0 +1,173 @@
+import base64
+import json
+from contextvars import copy_context
+import numpy as np
+import plotly.io
+import pytest
+from dash import Dash, Patch
+from dash._callback_context import context_value
+from dash._utils import AttributeDict
+from dash.exceptions import PreventUpdate
+from components import data_cleaning, data_loader, dataset, schema, scattermap_component
+from app import plotable_columns
+
+"""
+Unselected points on the map cannot be hovered, updates that keep the traces are sent as partial updates (Patch) that
+give the same figure as a full rebuild, and the level-of-detail map keeps its view (zoom and bounds) across relayout
+events that do not change it.
+"""
+
+def _call(callback, args: tuple, trigger: str):
+    # Callbacks read ctx.triggered_id, so run them in a context that looks like a real request
+    def run():
+        context_value.set(AttributeDict(triggered_inputs=[{"prop_id": trigger, "value": None}], inputs_list=[], states_list=[], outputs_list=[]))
+        return callback(*args)
+    return copy_context().run(run)
+
+def _register() -> dict:
+    data = schema.encode_categories(data_loader.load_incidents(), plotable_columns + data_cleaning.GROUPABLE_FEATURES)
+    app = Dash(__name__)
+    data_cleaning.store(app, id="data_store", all_data=data)
+    scattermap_component.render(app, all_data=dataset.current().frame, id="map")
+    found = {}
+    for key, entry in app.callback_map.items():
+        for output in ("data_store.data", "map.figure"):
+            if output in key and "callback" in entry:
+                found[output] = entry["callback"].__wrapped__
+    return found
+
+def _plain(value):
+    # JSON of a figure with its typed arrays ({"dtype", "bdata"}, as plotly encodes arrays in figures) as plain lists
+    if isinstance(value, dict) and set(value) >= {"dtype", "bdata"}:
+        array = np.frombuffer(base64.b64decode(value["bdata"]), dtype=value["dtype"])
+        return array.reshape(value["shape"]).tolist() if "shape" in value else array.tolist()
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_plain(item) for item in value]
+    return value
+
+def _figure_json(figure) -> dict:
+    return _plain(json.loads(plotly.io.to_json(figure)))
+
+def _apply(figure: dict, update) -> dict:
+    # Applies the assignments of a partial update to the JSON of the figure shown before it, as the browser does
+    for operation in update.to_plotly_json()["operations"]:
+        assert operation["operation"] == "Assign"
+        *path, last = operation["location"]
+        target = figure
+        for key in path:
+            target = target.setdefault(key, {}) if isinstance(key, str) else target[key]
+        target[last] = _plain(json.loads(plotly.io.json.to_json_plotly(operation["params"]["value"])))
+    return figure
+
+def _traces(figure: dict) -> list[dict]:
+    return figure["data"]
+
+@pytest.fixture
+def callbacks():
+    return _register()
+
+@pytest.fixture
+def lod_callbacks(monkeypatch):
+    monkeypatch.setattr(scattermap_component, "LOD_MIN_POINTS", 0)  # Level of detail for the real (small) dataset
+    monkeypatch.setattr(scattermap_component, "MAX_POINTS", 500)
+    return _register()
+
+@pytest.mark.parametrize("secondary", [[], "Victim.injury"])
+def test_unselected_points_cannot_be_hovered(callbacks, secondary):
+    store, change_display = callbacks["data_store.data"], callbacks["map.figure"]
+    uids = dataset.current().frame["UID"].to_numpy()[::3]
+    selection = {"points": [{"customdata": [int(uid)]} for uid in uids]}
+    value = _call(store, (selection, [1900, 2022], None, None, None, "State", secondary, None, None), "map_selection.data")
+    figure, _ = _call(change_display, (value, "State", secondary, None, None), "data_store.data")
+    hovered, skipped = set(), set()
+    for trace in figure.data:
+        trace_uids = {row[0] for row in trace.customdata}
+        if trace.hoverinfo == "skip":
+            assert trace.hovertemplate is None
+            skipped |= trace_uids
+        else:
+            assert trace.hovertemplate
+            hovered |= trace_uids
+    frame = dataset.current().frame
+    in_window = set(frame.loc[frame["Incident.year"].between(1900, 2022), "UID"])
+    assert hovered == in_window & set(uids)
+    assert skipped == in_window - set(uids)
+    names = [trace.name for trace in figure.data if trace.showlegend is not False]
+    assert len(names) == len(set(names))  # One legend entry per color
+
+@pytest.mark.parametrize("change", ["selection", "window"])
+def test_selection_change_is_a_patch(callbacks, change):
+    store, change_display = callbacks["data_store.data"], callbacks["map.figure"]
+    value = _call(store, (None, [1900, 2022], None, None, None, "State", [], None, None), "slider.value")
+    figure, state = _call(change_display, (value, "State", [], None, None), "data_store.data")
+    if change == "selection":
+        uids = dataset.current().frame["UID"].to_numpy()[::3]
+        selection = {"points": [{"customdata": [int(uid)]} for uid in uids]}
+        value = _call(store, (selection, [1900, 2022], None, None, None, "State", [], None, None), "map_selection.data")
+    else:
+        value = _call(store, (None, [1950, 2022], None, None, None, "State", [], None, None), "slider.value")
+    update, patched_state = _call(change_display, (value, "State", [], None, state), "data_store.data")
+    assert isinstance(update, Patch)
+    rebuilt, rebuilt_state = _call(change_display, (value, "State", [], None, None), "data_store.data")
+    assert patched_state == rebuilt_state
+    assert _traces(_apply(_figure_json(figure), update)) == _traces(_figure_json(rebuilt))
+
+def _patched(update) -> set[str]:
+    # Names of the trace properties a partial update assigns
+    return {".".join(str(key) for key in operation["location"][2:]) for operation in update.to_plotly_json()["operations"]}
+
+def test_opacity_change_is_a_patch(callbacks):
+    store, change_display = callbacks["data_store.data"], callbacks["map.figure"]
+    value = _call(store, (None, [1900, 2022], None, None, None, [], [], None, None), "slider.value")
+    figure, state = _call(change_display, (value, [], [], None, None), "data_store.data")
+    selection = {"points": [{"customdata": [int(uid)]} for uid in dataset.current().frame["UID"].to_numpy()[::2]]}
+    value = _call(store, (selection, [1900, 2022], None, None, None, [], [], None, None), "map_selection.data")
+    update, _ = _call(change_display, (value, [], [], None, state), "data_store.data")
+    assert isinstance(update, Patch) and "marker.opacity" in _patched(update)
+    rebuilt, _ = _call(change_display, (value, [], [], None, None), "data_store.data")
+    assert _traces(_apply(_figure_json(figure), update)) == _traces(_figure_json(rebuilt))
+
+def test_color_change_is_a_patch(callbacks):
+    store, change_display = callbacks["data_store.data"], callbacks["map.figure"]
+    def click(state_name):  # A bar of the default bar chart of State
+        bar = {"points": [{"curveNumber": 0, "pointNumber": 0, "x": state_name}]}
+        return _call(store, (None, [1900, 2022], bar, None, None, "State", [], None, None), "stacked_bar.clickData")
+    figure, state = _call(change_display, (click("NSW"), "State", [], None, None), "data_store.data")
+    value = click("QLD")
+    update, _ = _call(change_display, (value, "State", [], None, state), "data_store.data")
+    assert isinstance(update, Patch) and any(name.endswith("marker.color") for name in _patched(update))
+    rebuilt, _ = _call(change_display, (value, "State", [], None, None), "data_store.data")
+    patched = _traces(_apply(_figure_json(figure), update))
+    assert patched == _traces(_figure_json(rebuilt))
+    frame = dataset.current().frame
+    on_top = patched[-1]  # Highlighted points are drawn last
+    assert {row[0] for row in on_top["customdata"]} == set(frame.loc[frame["Incident.year"].between(1900, 2022) & (frame["State"] == "QLD"), "UID"])
+    assert set(on_top["marker"]["color"]) == {"#636EFA"}
+
+def test_view_survives_relayout_events_without_view(lod_callbacks):
+    store, change_display = lod_callbacks["data_store.data"], lod_callbacks["map.figure"]
+    value = _call(store, (None, [1900, 2022], None, None, None, "State", [], None, None), "slider.value")
+    first_figure, state = _call(change_display, (value, "State", [], None, None), "data_store.data")
+    assert state["layout"] == "clusters"  # More than MAX_POINTS incidents in view
+
+    # Zoomed in on Sydney: few enough incidents in view to draw them one by one
+    sydney = {"map.zoom": 9, "map._derived": {"coordinates": [[150.9, -33.6], [151.5, -33.6], [151.5, -34.1], [150.9, -34.1]]}}
+    zoomed, state = _call(change_display, (value, "State", [], sydney, state), "map.relayoutData")
+    assert state["layout"] != "clusters" and state["view"]["zoom"] == 9
+    points = sum(len(trace.lat) for trace in zoomed.data)
+
+    # Relayout events without view keys change nothing
+    for event in ({"autosize": True}, {"dragmode": "lasso"}):
+        with pytest.raises(PreventUpdate):
+            _call(change_display, (value, "State", [], event, state), "map.relayoutData")
+
+    # A store update after such an event still draws the incidents in the last known view
+    value = _call(store, (None, [1950, 2022], None, None, None, "State", [], None, None), "slider.value")
+    redrawn, state = _call(change_display, (value, "State", [], {"dragmode": "lasso"}, state), "data_store.data")
+    assert state["layout"] != "clusters" and state["view"]["zoom"] == 9
+    redrawn = _apply(_figure_json(zoomed), redrawn) if isinstance(redrawn, Patch) else _figure_json(redrawn)
+    frame = dataset.current().frame
+    in_view = frame["Incident.year"].between(1950, 2022) & frame["Longitude"].between(150.9, 151.5) & frame["Latitude"].between(-34.1, -33.6)
+    assert sum(len(trace.get("lat", [])) for trace in redrawn["data"]) == in_view.sum() < points
@@ -0,0 +1,18 @@
+import logging
+from app import create_app
+
+"""
+WSGI entry point for running the app with several worker processes, e.g. with gunicorn:
+    gunicorn --workers 4 --preload --bind 0.0.0.0:8050 wsgi:server
+With --preload the data is loaded once, before the workers are forked. Either way, the dataset and the arrays derived
+from it are memory-mapped from the .cache folder (see data_loader.py), so the workers share one copy of them.
+The default "compact" data store keeps no per-user state on the server, so any worker can handle any request;
+STORE_MODE = "server" keeps filtered dataframes per process and would need sticky sessions instead.
+With INGEST_DIR set, every worker watches the drop directory itself (see ingest.py). The watcher is not started here:
+with --preload this module is loaded in the master process, which serves no requests (and threads do not survive the
+fork). gunicorn.conf.py, which gunicorn reads from the working directory, starts it in every worker instead.
+"""
+
+logging.basicConfig(level=logging.INFO)  # Gunicorn does not configure the app's loggers (e.g. the files added or skipped by ingest.py)
+app = create_app(watch_ingest_dir=False)  # The workers start the INGEST_DIR watcher, see gunicorn.conf.py
+server = app.server  # The WSGI application